@@ -1,20 +1,56 @@
-from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, send_file, session
-import requests, json, io, os, csv, smtplib, schedule, threading, time
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, send_file, session, g
+import json, io, os, csv, math, threading, time, zlib, logging
+import upstream, closing_ledger, brand_store, metrics, bulk_notify, txn_archive
+from cache import TTLCache, StaleWhileRevalidate
+from balance_engine import apply_balances
 from datetime import date, datetime, timedelta
-from openpyxl import Workbook
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
+from concurrent.futures import ThreadPoolExecutor
+from mailer import MailDispatcher, build_attachment
+from jobs import JobRunner
+from voucher_pipeline import (
+    NOT_FETCHED, LOOKUP_FAILED, EXPORT_FIELDS, parse_query_date,
+    day_closing_balance, remember_day_closing, prev_closing_or_failed,
+    fetch_providers_concurrently, write_excel, send_daily_excel_report,
+)
+
+# LOG_LEVEL=DEBUG turns on the per-row diagnostics (sampled, see balance_engine)
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
+log = logging.getLogger("dashboard")
 
 app = Flask(__name__)
-API_BASE_URL = "https://nexus.payppy.app/api/referral-dashboard"
+API_BASE_URL = f"{upstream.NEXUS_BASE}/api/referral-dashboard"
 
 app.secret_key = "pepmo-admin-dashboard-secret-key"  # required for session
 
 # ensure tmp directory exists
 os.makedirs("tmp", exist_ok=True)
 
+# background jobs for reports and slow admin actions
+JOBS = JobRunner(max_workers=int(os.environ.get("JOB_WORKERS", "4")))
+
+# ---------------------------------------------------------
+# 📈 Per-route latency (served at /metrics)
+# ---------------------------------------------------------
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    # streamed bodies (CSV / pretty JSON) are timed up to the headers
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started,
+                                     route=route, method=request.method)
+        metrics.HTTP_REQUESTS.inc(route=route, method=request.method,
+                                  status=str(response.status_code))
+    return response
+
 @app.route("/", methods=["GET", "POST"])
 def home():
     if request.method == "POST":
@@ -23,14 +59,35 @@ def home():
     return render_template("home.html")
 
 
+# ---------------------------------------------------------
+# 🔗 Referral dashboards (short-TTL cache per code)
+# ---------------------------------------------------------
+REFERRAL_CACHE = TTLCache(max_entries=int(os.environ.get("REFERRAL_CACHE_SIZE", "2000")))
+REFERRAL_TTL = int(os.environ.get("REFERRAL_CACHE_TTL", "60"))   # seconds
+REFERRAL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="referral")
+REFERRAL_LOOKUP_MAX = 200   # codes per batch lookup
+REFERRAL_CSV_FIELDS = ["referral_code", "status", "referrer_email", "referrals_count",
+                       "first_referral", "last_referral", "error"]
+
+
+def fetch_referral(referral_code):
+    """Cached upstream referral dashboard → (status_code, data)."""
+    def load():
+        response = upstream.get("referral", f"{API_BASE_URL}/{referral_code}")
+        return response.status_code, response.json() if response.status_code == 200 else None
+
+    # only successful lookups are cached, so a new code shows up straight away
+    return REFERRAL_CACHE.get_or_load(
+        referral_code, load, lambda res: REFERRAL_TTL if res[0] == 200 else 0,
+    )
+
+
 @app.route("/dashboard/<referral_code>")
 def show_dashboard(referral_code):
     try:
-        api_url = f"{API_BASE_URL}/{referral_code}"
-        response = requests.get(api_url)
+        status, data = fetch_referral(referral_code)
 
-        if response.status_code == 200:
-            data = response.json()
+        if status == 200:
             return render_template("dashboard.html", data=data)
         else:
             return render_template("dashboard.html", error="Referral code not found.")
@@ -38,109 +95,149 @@ def show_dashboard(referral_code):
         return render_template("dashboard.html", error=str(e))
 
 
-API_URL = "https://nexus.payppy.app/api/dashboard/v2/voucher-transactions"
-DETAIL_API_URL = "https://nexus.payppy.app/api/dashboard/v2/voucher-transactions"
-
-TRANSACTION_CACHE = []   # stored for drawer merging
+def referral_summary(referral_code):
+    """One row of the batch lookup table; upstream errors become the row's error."""
+    row = {"referral_code": referral_code}
+    try:
+        status, data = fetch_referral(referral_code)
+    except Exception as e:
+        return dict(row, status="error", error=str(e))
+    if status != 200:
+        return dict(row, status="not found" if status == 404 else "error",
+                    error=None if status == 404 else f"Upstream error {status}")
+
+    dates = sorted(r.get("date") for r in data.get("referrals_by_date") or [] if r.get("date"))
+    return dict(
+        row, status="ok", error=None,
+        referrer_email=data.get("referrer_email"),
+        referrals_count=data.get("referrals_count"),
+        first_referral=dates[0] if dates else None,
+        last_referral=dates[-1] if dates else None,
+    )
 
-# ---------------------------------------------------------
-# 🧠 Get Previous Day Closing Balance
-# ---------------------------------------------------------
-def get_previous_day_closing_balance(current_date_str):
-    from datetime import datetime, timedelta
 
-    # 1️⃣ Parse input date in either format
-    try:
-        current_date = datetime.strptime(current_date_str, "%Y-%m-%d").date()
-    except ValueError:
-        current_date = datetime.strptime(current_date_str, "%d/%m/%Y").date()
+def parse_referral_codes(raw):
+    """
+    Codes from a form field / JSON list: comma, space or newline separated,
+    de-duplicated. Raises ValueError past REFERRAL_LOOKUP_MAX codes.
+    """
+    if isinstance(raw, list):
+        raw = " ".join(str(c) for c in raw)
+    codes = (raw or "").replace(",", " ").split()
+    if len(codes) > REFERRAL_LOOKUP_MAX:
+        raise ValueError(f"{len(codes)} codes, at most {REFERRAL_LOOKUP_MAX} per lookup")
+    return list(dict.fromkeys(codes))
 
-    prev_date = current_date - timedelta(days=1)
-    prev_date_str = prev_date.strftime("%Y-%m-%d")
 
-    url = f"{API_URL}?date={prev_date_str}&provider=pinelabs"
-    print(f"[prev-day] Fetching previous-day data from: {url}")
+@app.route("/referrals/lookup", methods=["GET", "POST"])
+def referral_lookup():
+    """
+    Look up many referral codes at once.
 
+    Codes come from the `codes` form field / query param or a JSON body
+    {"codes": [...]}; they are fetched concurrently (cached per code).
+    `format=csv` downloads the table, `format=json` returns it as JSON,
+    otherwise the lookup page is rendered.
+    """
+    body = request.get_json(silent=True) or {}
+    fmt = body.get("format") or request.values.get("format")
     try:
-        r = requests.get(url)   # no timeout, as you chose
-        if r.status_code != 200:
-            print("[prev-day] Non-200 status:", r.status_code)
-            return None
-
-        data = r.json().get("data", [])
-        if not data:
-            print("[prev-day] No data for prev day")
-            return None
-
-        # newest → oldest
-        data.sort(
-            key=lambda x: datetime.strptime(
-                f"{x['date']} {x['time']}", "%Y-%m-%d %H:%M:%S"
-            ),
-            reverse=True,
+        codes = parse_referral_codes(body.get("codes") or request.values.get("codes"))
+    except ValueError as e:
+        if fmt in ("csv", "json"):
+            return jsonify({"error": str(e)}), 400
+        return render_template("referral_lookup.html", error=str(e))
+
+    rows = list(REFERRAL_POOL.map(referral_summary, codes))
+
+    if fmt == "json":
+        return jsonify({"count": len(rows), "rows": rows})
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=REFERRAL_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+        return Response(
+            out.getvalue(), mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=referral_codes.csv"},
         )
+    return render_template(
+        "referral_lookup.html", codes=codes, rows=rows,
+        found=sum(1 for r in rows if r["status"] == "ok"),
+        total_referrals=int(sum(_num_or_zero(r.get("referrals_count")) for r in rows)),
+    )
 
-        # 2️⃣ Pick latest SUCCESS txn with valid svc_balance
-        for txn in data:
-            status = txn.get("voucher_status")
-            if status != "SUCCESS":
-                # skip failed / pending vouchers
-                continue
-
-            raw = txn.get("svc_balance")
-            try:
-                bal = float(raw)
-                print(
-                    f"[prev-day] Using closing from SUCCESS order "
-                    f"{txn.get('order_id')}: {bal}"
-                )
-                return bal
-            except (TypeError, ValueError):
-                # svc_balance missing / invalid → try older txn
-                continue
 
-        print("[prev-day] No SUCCESS txn had a valid svc_balance")
-        return None
+# voucher fetches, the previous-day closing, Excel and the report email
+# live in voucher_pipeline, shared with scheduler.py
+DETAIL_API_URL = f"{upstream.NEXUS_BASE}/api/dashboard/v2/voucher-transactions"
 
-    except Exception as e:
-        print("[prev-day] Error:", e)
-        return None
+# processed day views keyed by (date, provider), used for drawer merging
+# and export; capped by total cached rows
+TRANSACTION_CACHE = TTLCache(
+    max_entries=int(os.environ.get("TXN_CACHE_MAX_DAYS", "32")),
+    max_weight=int(os.environ.get("TXN_CACHE_MAX_ROWS", "300000")),
+    weigh=lambda day: len(day["data"]),
+)
+TODAY_TTL = 60           # seconds, today's rows keep arriving
+PAST_DAY_TTL = 6 * 3600  # past days are complete
 
 # ---------------------------------------------------------
-# 🔎 Fetch provider data (Pinelabs or Gyftr)
+# 🧠 Load one processed day (cached per date + provider)
 # ---------------------------------------------------------
-def fetch_provider_data(query_date, provider_param=None):
-    if provider_param == "gyftr":
-        url = f"{API_URL}?date={query_date}&provider=gyftr"
-    else:
-        url = f"{API_URL}?date={query_date}"
+def provider_key(provider):
+    return provider if provider in ("all", "gyftr") else "pinelabs"
 
-    try:
-        r = requests.get(url)
-        if r.status_code == 200:
-            return r.json()
-        return {"data": [], "total_amount": 0, "total_volume": 0}
-    except:
-        return {"data": [], "total_amount": 0, "total_volume": 0}
 
+def day_cache_ttl(day_view):
+    if day_view["failed_providers"] or day_view["prev_closing_failed"]:
+        return 0   # never cache partial results
+    if parse_query_date(day_view["query_date"]) < date.today():
+        return PAST_DAY_TTL
+    return TODAY_TTL
 
 
-@app.route("/voucher-transactions")
-def voucher_transactions():
-    query_date = request.args.get("date", str(date.today()))
-    provider = request.args.get("provider")
+def get_voucher_day(query_date, provider, prev_closing=NOT_FETCHED):
+    """
+    Processed day view for `query_date` (either date format) and provider.
+
+    `prev_closing` lets a caller that already knows the previous day's
+    closing (e.g. a date range walking forward) skip looking it up.
+    """
+    query_date = parse_query_date(query_date).isoformat()
+    provider = provider_key(provider)
+    return TRANSACTION_CACHE.get_or_load(
+        (query_date, provider),
+        lambda: load_voucher_day(query_date, provider, prev_closing),
+        day_cache_ttl,
+    )
 
+
+def index_transactions(transactions):
+    """
+    Build order_id → row and user_id → rows lookups for a loaded day,
+    and stamp each row with its lowercase `_search` key for the table.
+    """
+    by_order, by_user = {}, {}
+    for txn in transactions:
+        by_order.setdefault(txn["order_id"], txn)
+        by_user.setdefault(txn.get("user_id"), []).append(txn)
+        txn._search = " ".join(
+            str(txn.get(f) or "") for f in SEARCH_FIELDS
+        ).lower()
+    return by_order, by_user
+
+
+def fetch_day_payload(query_date, provider, with_prev_closing=True):
+    """Upstream fetch half of load_voucher_day → (data, prev_closing, failed)."""
     # ----------------------------
     # Combine data if provider=all
     # ----------------------------
     if provider == "all":
-        d1 = fetch_provider_data(query_date, "pinelabs")
-        d2 = fetch_provider_data(query_date, "gyftr")
-
-        for t in d1.get("data", []):
-            t["provider"] = "pinelabs"
-        for t in d2.get("data", []):
-            t["provider"] = "gyftr"
+        results, prev_closing, failed_providers = fetch_providers_concurrently(
+            query_date, ["pinelabs", "gyftr"], with_prev_closing=with_prev_closing
+        )
+        d1, d2 = results["pinelabs"], results["gyftr"]
 
         all_txns = d1["data"] + d2["data"]
 
@@ -153,112 +250,212 @@ def voucher_transactions():
             "total_volume": total_volume,
         }
     else:
-        data = fetch_provider_data(query_date, provider)
-        for t in data.get("data", []):
-            t["provider"] = provider if provider else "pinelabs"
+        # gyftr rows carry no balances, so only pinelabs needs prev closing
+        single = "gyftr" if provider == "gyftr" else "pinelabs"
+        results, prev_closing, failed_providers = fetch_providers_concurrently(
+            query_date, [single], with_prev_closing=with_prev_closing and single == "pinelabs"
+        )
+        data = results[single]
+
+    return data, prev_closing, failed_providers
+
 
+def build_voucher_day(query_date, provider, data, prev_closing, failed_providers):
+    """
+    Sort, balance and index one fetched day into the cached view dict.
+
+    A `prev_closing` of LOOKUP_FAILED balances the day as if there were
+    no previous closing and marks the view so it is not cached.
+    """
+    prev_closing_failed = prev_closing is LOOKUP_FAILED
+    if prev_closing_failed:
+        prev_closing = None
     # ----------------------------
     # Sort newest → oldest for display
     # ----------------------------
+    # the only sort; the balance engine walks it in reverse
     transactions = data.get("data", [])
-    for txn in transactions:
-        txn["_dt"] = datetime.strptime(
-            f"{txn['date']} {txn['time']}",
-            "%Y-%m-%d %H:%M:%S"
-        )
-    transactions.sort(key=lambda x: x["_dt"], reverse=True)
+    with metrics.stage("sort"):
+        transactions.sort(key=lambda x: x._ts, reverse=True)
 
     # ==========================================================
     # 🧠 PINELABS BALANCE + DEPOSIT LOGIC  (oldest → newest)
     # ==========================================================
+    with metrics.stage("balances"):
+        latest_svc_balance = apply_balances(transactions, prev_closing)
+    if latest_svc_balance is None:
+        latest_svc_balance = 0
+
     pinelabs_txns = [t for t in transactions if t["provider"] == "pinelabs"]
+    if "pinelabs" not in failed_providers:
+        with metrics.stage("ledger"):
+            remember_day_closing(query_date, pinelabs_txns)
+
+    with metrics.stage("index"):
+        by_order, by_user = index_transactions(transactions)
+
+    return {
+        **data,
+        "data": transactions,
+        "by_order": by_order,
+        "by_user": by_user,
+        "query_date": query_date,
+        "provider": provider,
+        "failed_providers": failed_providers,
+        "prev_closing_failed": prev_closing_failed,
+        "latest_svc_balance": latest_svc_balance,
+    }
 
-    # process in chronological order
-    pinelabs_sorted = sorted(pinelabs_txns, key=lambda x: x["_dt"])
 
-    prev_closing = get_previous_day_closing_balance(query_date)  # float or None
-    balance_map = {}
+def load_voucher_day(query_date, provider, prev_closing=NOT_FETCHED):
+    data, fetched_prev, failed_providers = fetch_day_payload(
+        query_date, provider, with_prev_closing=prev_closing is NOT_FETCHED
+    )
+    if prev_closing is NOT_FETCHED:
+        prev_closing = fetched_prev
+    return build_voucher_day(query_date, provider, data, prev_closing, failed_providers)
 
-    for txn in pinelabs_sorted:
-        raw_svc = txn.get("svc_balance")
+# ---------------------------------------------------------
+# 📅 Date-range mode (from / to)
+# ---------------------------------------------------------
+RANGE_MAX_DAYS = 62
+RANGE_MAX_PARALLEL = 4   # days fetched at once
+
+# assembled range views keyed by (from, to, provider), so paging, sorting
+# and searching a range reuse one view instead of re-assembling it from
+# TRANSACTION_CACHE, which cannot hold every day of a long range; rows
+# are shared with the day views, so this mostly holds the lists
+RANGE_CACHE = TTLCache(
+    max_entries=int(os.environ.get("RANGE_CACHE_SIZE", "4")),
+    max_weight=TRANSACTION_CACHE.max_weight,
+    weigh=lambda view: len(view["data"]),
+)
 
-        try:
-            svc_balance = float(raw_svc)
-        except (TypeError, ValueError):
-            svc_balance = None
-
-        # ---------------- Opening / Closing ----------------
-        if prev_closing is None:
-            # first txn of the day with no prev closing
-            if svc_balance is not None:
-                opening = svc_balance
-                closing = svc_balance
-            else:
-                opening = None
-                closing = None
-        else:
-            # we know previous closing
-            opening = prev_closing
-            if svc_balance is None:
-                closing = opening
-            else:
-                closing = svc_balance
 
-        # ---------------- Deposit ----------------
-        deposit = None
-        try:
-            if opening is not None and closing is not None:
-                svc_ded = float(txn.get("svc_deduction") or 0)
+def day_closing_for_carry(day_view):
+    """Closing to carry into the next day, same value the ledger would hold."""
+    if "pinelabs" in day_view["failed_providers"]:
+        return NOT_FETCHED   # unknown, next day must look it up
+    cached = closing_ledger.get_closing("pinelabs", day_view["query_date"])
+    if cached is not None:
+        return cached
+    closing, _ = day_closing_balance(
+        [t for t in day_view["data"] if t["provider"] == "pinelabs"]
+    )
+    return closing
 
-                expected_closing = opening - svc_ded
-                raw_diff = closing - expected_closing
-                diff = round(raw_diff, 2)
 
-                if diff > 0:
-                    deposit = diff
-                else:
-                    deposit = 0.0
-        except Exception as e:
-            print("Deposit calc error for", txn.get("order_id"), e)
-            deposit = None
+def range_cache_ttl(range_view):
+    if range_view["failed_providers"] or range_view["prev_closing_failed"]:
+        return 0   # never cache partial results
+    if parse_query_date(range_view["to_date"]) < date.today():
+        return PAST_DAY_TTL
+    return TODAY_TTL
 
-        print(
-            f"Txn {txn['order_id']}: "
-            f"Opening={opening}, Closing={closing}, Deposit={deposit}"
-        )
 
-        # move forward only if we have a closing value
-        if closing is not None:
-            prev_closing = closing
+def get_voucher_range(from_date, to_date, provider):
+    """Combined view for [from_date, to_date] (cached, see load_voucher_range)."""
+    start, end = sorted((parse_query_date(from_date), parse_query_date(to_date)))
+    start, end, provider = start.isoformat(), end.isoformat(), provider_key(provider)
+    return RANGE_CACHE.get_or_load(
+        (start, end, provider),
+        lambda: load_voucher_range(start, end, provider),
+        range_cache_ttl,
+    )
 
-        balance_map[txn["order_id"]] = {
-            "opening": opening,
-            "closing": closing,
-            "deposit": deposit,
-        }
 
-    # ----------------------------
-    # Apply balances to all txns
-    # ----------------------------
-    for txn in transactions:
-        if txn["provider"] == "pinelabs":
-            bal = balance_map.get(txn["order_id"], {})
-            txn["opening_balance"] = bal.get("opening")
-            txn["closing_balance"] = bal.get("closing")
-            txn["deposit"] = bal.get("deposit")
-        else:
-            txn["opening_balance"] = None
-            txn["closing_balance"] = None
-            txn["deposit"] = None
+def load_voucher_range(from_date, to_date, provider):
+    """
+    Combined view for every day in [from_date, to_date].
 
-    # ----------------------------
-    # Top card latest SVC balance
-    # ----------------------------
-    pin_only = [t for t in transactions if t["provider"] == "pinelabs"]
-    latest_svc_balance = pin_only[0]["closing_balance"] if pin_only else 0
+    Uncached days are fetched concurrently (RANGE_MAX_PARALLEL at a
+    time), then balanced oldest → newest so each day's opening is the
+    previous day's closing instead of another upstream lookup. Each day
+    also lands in TRANSACTION_CACHE, so drawer merges still work.
+    """
+    start, end = parse_query_date(from_date), parse_query_date(to_date)
+    if end < start:
+        start, end = end, start
+    n_days = (end - start).days + 1
+    if n_days > RANGE_MAX_DAYS:
+        raise ValueError(f"Date range is limited to {RANGE_MAX_DAYS} days")
+
+    provider = provider_key(provider)
+    days = [(start + timedelta(days=i)).isoformat() for i in range(n_days)]
+    cached = {d: TRANSACTION_CACHE.get((d, provider)) for d in days}
+    missing = [d for d in days if cached[d] is None]
+
+    # 1️⃣ fetch every uncached day in parallel (balances come later)
+    with ThreadPoolExecutor(max_workers=RANGE_MAX_PARALLEL, thread_name_prefix="range") as pool:
+        first_prev = pool.submit(prev_closing_or_failed, days[0]) \
+            if cached[days[0]] is None and provider != "gyftr" else None
+        fetched = dict(zip(missing, pool.map(
+            lambda d: fetch_day_payload(d, provider, with_prev_closing=False), missing
+        )))
+        carry = first_prev.result() if first_prev else None
+
+    # 2️⃣ walk forward, carrying each closing into the next day
+    views = []
+    for d in days:
+        view = cached[d]
+        if view is None:
+            data, _, failed = fetched[d]
+            if carry is NOT_FETCHED:
+                carry = prev_closing_or_failed(d)
+            view = build_voucher_day(d, provider, data, carry, failed)
+            ttl = day_cache_ttl(view)
+            if ttl:
+                TRANSACTION_CACHE.set((d, provider), view, ttl)
+        views.append(view)
+        carry = day_closing_for_carry(view)
+
+    views.reverse()   # newest day first, matching the row order
+    transactions = [t for v in views for t in v["data"]]
+
+    return {
+        "data": transactions,
+        "from_date": days[0],
+        "to_date": days[-1],
+        "provider": provider,
+        "failed_providers": sorted({p for v in views for p in v["failed_providers"]}),
+        "failed_days": [v["query_date"] for v in views if v["failed_providers"]],
+        "prev_closing_failed": any(v["prev_closing_failed"] for v in views),
+        "latest_svc_balance": views[0]["latest_svc_balance"],
+        "total_amount": sum(float(v.get("total_amount", 0)) for v in views),
+        "total_volume": sum(float(v.get("total_volume", 0)) for v in views),
+        "days": [
+            {
+                "date": v["query_date"],
+                "count": len(v["data"]),
+                "total_amount": float(v.get("total_amount", 0)),
+                "total_volume": float(v.get("total_volume", 0)),
+            }
+            for v in views
+        ],
+    }
 
-    global TRANSACTION_CACHE
-    TRANSACTION_CACHE = transactions
+
+def requested_range():
+    """(from, to) when the request asks for range mode, else None."""
+    from_date, to_date = request.args.get("from"), request.args.get("to")
+    if from_date and to_date:
+        return from_date, to_date
+    return None
+
+
+@app.route("/voucher-transactions")
+def voucher_transactions():
+    query_date = request.args.get("date", str(date.today()))
+    provider = request.args.get("provider")
+    date_range = requested_range()
+
+    try:
+        if date_range:
+            day = get_voucher_range(*date_range, provider)
+        else:
+            day = get_voucher_day(query_date, provider)
+    except ValueError as e:
+        return f"Invalid date: {e}", 400
 
     def fmt(n):
         try:
@@ -266,15 +463,175 @@ def voucher_transactions():
         except Exception:
             return n
 
-    return render_template(
-        "voucher_dashboard.html",
-        data={**data, "data": transactions},
-        query_date=query_date,
-        provider=provider,
-        latest_svc_balance=fmt(latest_svc_balance),
-        total_amount=fmt(data.get("total_amount", 0)),
-        total_volume=fmt(data.get("total_volume", 0)),
+    with metrics.stage("render"):
+        return render_template(
+            "voucher_dashboard.html",
+            data=day,
+            query_date=day.get("query_date", query_date),
+            date_range=date_range and (day["from_date"], day["to_date"]),
+            provider=day["provider"],
+            failed_providers=day["failed_providers"],
+            latest_svc_balance=fmt(day["latest_svc_balance"]),
+            total_amount=fmt(day.get("total_amount", 0)),
+            total_volume=fmt(day.get("total_volume", 0)),
+        )
+
+# ---------------------------------------------------------
+# 📄 Paged / sorted / filtered rows for the dashboard table
+# ---------------------------------------------------------
+
+SEARCH_FIELDS = ("order_id", "user_id", "user_name", "brand", "provider",
+                 "voucher_status", "payment_status", "refund_status")
+TABLE_FIELDS = ["user_id"] + EXPORT_FIELDS
+SORT_KEYS = {
+    "time": lambda t: t._ts,
+    "order_id": lambda t: t.order_id or "",
+    "user_name": lambda t: (t.user_name or "").lower(),
+    "brand": lambda t: (t.brand or "").lower(),
+    "provider": lambda t: t.provider or "",
+    "voucher_status": lambda t: t.voucher_status or "",
+    "requested_amount": lambda t: _num_or_zero(t.requested_amount),
+    "paid_by_user": lambda t: _num_or_zero(t.paid_by_user),
+    "svc_deduction": lambda t: _num_or_zero(t.svc_deduction),
+    "closing_balance": lambda t: _num_or_zero(t.closing_balance),
+    "deposit": lambda t: _num_or_zero(t.deposit),
+}
+MAX_PER_PAGE = 500
+# sorted copies kept per cached view; each is a full-length row list that
+# the caches' row weights do not see, so only the latest few are kept
+SORTED_MEMO_MAX = 2
+
+
+def _num_or_zero(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def sorted_rows(view, sort, descending):
+    """Rows of a view in the requested order, memoised on the view."""
+    if sort == "time":
+        # rows are stored newest → oldest already
+        return view["data"] if descending else view["data"][::-1]
+    memo = view.setdefault("_sorted", {})
+    key = (sort, descending)
+    rows = memo.get(key)
+    if rows is None:
+        rows = sorted(view["data"], key=SORT_KEYS[sort], reverse=descending)
+        while len(memo) >= SORTED_MEMO_MAX:
+            memo.pop(next(iter(memo)), None)   # oldest first
+        memo[key] = rows
+    return rows
+
+
+@app.route("/voucher-transactions/rows")
+def voucher_transaction_rows():
+    """
+    One page of the dashboard table as JSON.
+
+    Same `date` / `from` / `to` / `provider` params as the page, plus
+    `page`, `per_page`, `sort`, `dir` (asc|desc), `q` (substring over
+    order id, user, brand, statuses), `status`, `row_provider`,
+    `brand` and `user_id` filters.
+    """
+    provider = provider_key(request.args.get("provider"))
+    date_range = requested_range()
+    try:
+        if date_range:
+            view = get_voucher_range(*date_range, provider)
+        else:
+            view = get_voucher_day(request.args.get("date", str(date.today())), provider)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    sort = request.args.get("sort", "time")
+    if sort not in SORT_KEYS:
+        sort = "time"
+    descending = request.args.get("dir", "desc") != "asc"
+
+    user_id = request.args.get("user_id")
+    if user_id and "by_user" in view and sort == "time":
+        rows = view["by_user"].get(user_id, [])
+        rows = rows if descending else rows[::-1]
+        user_id = None
+    else:
+        rows = sorted_rows(view, sort, descending)
+
+    q = (request.args.get("q") or "").strip().lower()
+    status = request.args.get("status")
+    row_provider = request.args.get("row_provider")
+    brand = (request.args.get("brand") or "").lower()
+    if q or status or row_provider or brand or user_id:
+        rows = [
+            t for t in rows
+            if (not q or q in t._search)
+            and (not status or t.voucher_status == status)
+            and (not row_provider or t.provider == row_provider)
+            and (not brand or (t.brand or "").lower() == brand)
+            and (not user_id or t.user_id == user_id)
+        ]
+
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 50)), 1), MAX_PER_PAGE)
+    except ValueError:
+        page, per_page = 1, 50
+
+    start = (page - 1) * per_page
+    return jsonify({
+        "total": len(rows),
+        "page": page,
+        "per_page": per_page,
+        "pages": max((len(rows) + per_page - 1) // per_page, 1),
+        "rows": [{f: t.get(f) for f in TABLE_FIELDS} for t in rows[start:start + per_page]],
+    })
+
+# ---------------------------------------------------------
+# 🧠 Per-order detail cache (behind the drawer)
+# ---------------------------------------------------------
+DETAIL_CACHE = TTLCache(max_entries=int(os.environ.get("DETAIL_CACHE_SIZE", "5000")))
+DETAIL_FINAL_TTL = 12 * 3600   # SUCCESS / refunded orders no longer change
+DETAIL_PENDING_TTL = 30
+DETAIL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="detail")
+PREFETCH_MAX_ITEMS = 50
+
+_prefetching = set()   # detail keys queued or loading, so repeat prefetches skip them
+_prefetching_lock = threading.Lock()
+
+TERMINAL_REFUND_STATUSES = ("SUCCESS", "REFUNDED")
+
+
+def detail_ttl(detail):
+    refund = str(detail.get("refund_status") or "").upper()
+    if detail.get("voucher_status") == "SUCCESS" or refund in TERMINAL_REFUND_STATUSES:
+        return DETAIL_FINAL_TTL
+    return DETAIL_PENDING_TTL
+
+
+def detail_key(provider, user_id, order_id):
+    return ("gyftr" if provider == "gyftr" else "pinelabs", user_id, order_id)
+
+
+def fetch_order_detail(provider, user_id, order_id):
+    """Cached upstream detail for one order; raises if upstream fails."""
+    key = detail_key(provider, user_id, order_id)
+    provider = key[0]
+
+    def load():
+        api_url = f"{DETAIL_API_URL}/{user_id}/{order_id}"
+        if provider == "gyftr":
+            api_url += "?provider=gyftr"
+        r = upstream.get("voucher-detail", api_url)
+        return r.status_code, r.json()
+
+    # upstream errors are still shown in the drawer, just not cached
+    status, detail = DETAIL_CACHE.get_or_load(
+        key,
+        load,
+        lambda res: detail_ttl(res[1]) if res[0] == 200 else 0,
     )
+    return detail
 
 # ---------------------------------------------------------
 # 🧠 Drawer — Single Voucher Merge API
@@ -283,16 +640,20 @@ def voucher_transactions():
 def voucher_transaction_detail(user_id, order_id):
     provider = request.args.get("provider")
 
-    api_url = f"{DETAIL_API_URL}/{user_id}/{order_id}"
-    if provider == "gyftr":
-        api_url += "?provider=gyftr"
-
     try:
-        detail = requests.get(api_url, timeout=30).json()
+        detail = fetch_order_detail(provider, user_id, order_id)
     except:
         return jsonify({"error": "Detail API failed"}), 500
 
-    matched = next((t for t in TRANSACTION_CACHE if t["order_id"] == order_id), None)
+    # merge with the row from the dashboard view the drawer was opened on,
+    # reloading it if it has expired or been evicted since
+    day = None
+    if request.args.get("date"):
+        try:
+            day = get_voucher_day(request.args["date"], request.args.get("view"))
+        except Exception as e:
+            log.warning("[drawer] could not load %s for merge: %s", request.args["date"], e)
+    matched = day["by_order"].get(order_id) if day else None
 
     if not matched:
         return jsonify(detail)
@@ -330,273 +691,166 @@ def voucher_transaction_detail(user_id, order_id):
     return jsonify(merged)
 
 # ---------------------------------------------------------
-# 🧠 Export Voucher Transactions to CSV
+# 🧠 Drawer — prefetch details for the visible rows
 # ---------------------------------------------------------
-@app.route("/voucher-transactions/export")
-def export_voucher_transactions():
+@app.route("/single-voucher-transactions/prefetch", methods=["POST"])
+def prefetch_voucher_details():
     """
-    Download current dashboard data as CSV.
+    Warm DETAIL_CACHE for a page of rows so the drawer opens instantly.
+
+    Body: {"items": [{"user_id": ..., "order_id": ..., "provider": ...}]}
 
-    Uses TRANSACTION_CACHE, so it exports whatever was last
-    loaded on the /voucher-transactions page (same date/provider filter).
+    Queues the uncached orders on DETAIL_POOL and answers 202 at once;
+    orders already cached or already queued are skipped.
     """
-    if not TRANSACTION_CACHE:
-        return "No data to export. Please open /voucher-transactions first.", 400
-
-    # You can tweak column order / fields as you like
-    fieldnames = [
-        "date",
-        "time",
-        "order_id",
-        "provider",
-        "user_name",
-        "brand",
-        "denomination",
-        "qty",
-        "requested_amount",
-        "paid_by_user",
-        "svc_deduction",
-        "opening_balance",
-        "closing_balance",
-        "deposit",
-        "payment_method",
-        "payment_status",
-        "voucher_status",
-        "refund_status",
-        "svc_balance",
-    ]
+    items = (request.get_json(silent=True) or {}).get("items", [])[:PREFETCH_MAX_ITEMS]
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # header row
-    writer.writerow(fieldnames)
-
-    for txn in TRANSACTION_CACHE:
-        row = [
-            txn.get("date"),
-            txn.get("time"),
-            txn.get("order_id"),
-            txn.get("provider"),
-            txn.get("user_name"),
-            txn.get("brand"),
-            txn.get("denomination"),
-            txn.get("qty"),
-            txn.get("requested_amount"),
-            txn.get("paid_by_user"),
-            txn.get("svc_deduction"),
-            txn.get("opening_balance"),
-            txn.get("closing_balance"),
-            txn.get("deposit"),
-            txn.get("payment_method"),
-            txn.get("payment_status"),
-            txn.get("voucher_status"),
-            txn.get("refund_status"),
-            txn.get("svc_balance"),
-        ]
-        writer.writerow(row)
+    queued = skipped = 0
+    for it in items:
+        if not (it.get("user_id") and it.get("order_id")):
+            continue
+        key = detail_key(it.get("provider"), it["user_id"], it["order_id"])
+        with _prefetching_lock:
+            if key in _prefetching or DETAIL_CACHE.contains(key):
+                skipped += 1
+                continue
+            _prefetching.add(key)
+        DETAIL_POOL.submit(prefetch_one, key)
+        queued += 1
 
-    csv_data = output.getvalue()
-    output.close()
+    return jsonify({"queued": queued, "skipped": skipped}), 202
 
-    filename = f"voucher-transactions-{date.today().isoformat()}.csv"
 
-    return Response(
-        csv_data,
-        mimetype="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        },
-    )
+def prefetch_one(key):
+    try:
+        fetch_order_detail(*key)
+    except Exception as e:
+        log.debug("[prefetch] %s failed: %s", key, e)
+    finally:
+        with _prefetching_lock:
+            _prefetching.discard(key)
 
 # ---------------------------------------------------------
-# 🧠 Export Voucher Transactions to EXCEL For Email
+# 🧠 Export Voucher Transactions to CSV
 # ---------------------------------------------------------
-def generate_excel(transactions):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Transactions"
-
-    headers = [
-        "date", "time", "order_id", "provider", "user_name",
-        "brand", "denomination", "qty", "requested_amount",
-        "paid_by_user", "svc_deduction", "opening_balance",
-        "closing_balance", "deposit", "payment_method",
-        "payment_status", "voucher_status", "refund_status",
-        "svc_balance"
-    ]
+CSV_CHUNK_ROWS = 1000
 
-    ws.append(headers)
 
-    for txn in transactions:
-        ws.append([
-            txn.get("date"),
-            txn.get("time"),
-            txn.get("order_id"),
-            txn.get("provider"),
-            txn.get("user_name"),
-            txn.get("brand"),
-            txn.get("denomination"),
-            txn.get("qty"),
-            txn.get("requested_amount"),
-            txn.get("paid_by_user"),
-            txn.get("svc_deduction"),
-            txn.get("opening_balance"),
-            txn.get("closing_balance"),
-            txn.get("deposit"),
-            txn.get("payment_method"),
-            txn.get("payment_status"),
-            txn.get("voucher_status"),
-            txn.get("refund_status"),
-            txn.get("svc_balance"),
-        ])
-
-    # save to memory
-    output = io.BytesIO()
-    wb.save(output)
-    return output.getvalue()
+class _LineBuffer:
+    """Minimal file-like target for csv.writer that hands back what was written."""
 
+    def __init__(self):
+        self.parts = []
 
-# ---------------------------------------------------------
-# 🧠 Send Email with Attachment
-# ---------------------------------------------------------
-def send_email_with_attachment(to_email, subject, body, file_bytes, filename):
-    SMTP_HOST = "smtp.hostinger.com"
-    SMTP_PORT = 587
-    SMTP_USER = "user@pepmo.app"
-    SMTP_PASS = "user@White#Cloud&9357"
+    def write(self, s):
+        self.parts.append(s)
 
-    msg = MIMEMultipart()
-    msg["From"] = SMTP_USER
-    msg["To"] = to_email
-    msg["Subject"] = subject
+    def drain(self):
+        out = "".join(self.parts)
+        self.parts = []
+        return out
 
-    msg.attach(MIMEText(body, "html"))
 
-    part = MIMEBase("application", "octet-stream")
-    part.set_payload(file_bytes)
-    encoders.encode_base64(part)
-    part.add_header("Content-Disposition", f"attachment; filename={filename}")
+def iter_csv(transactions, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield the export CSV as encoded chunks of `chunk_rows` rows."""
+    buf = _LineBuffer()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
 
-    msg.attach(part)
+    for i, txn in enumerate(transactions, 1):
+        writer.writerow([txn.get(f) for f in EXPORT_FIELDS])
+        if i % chunk_rows == 0:
+            yield buf.drain().encode("utf-8")
 
-    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-    server.starttls()
-    server.login(SMTP_USER, SMTP_PASS)
-    server.send_message(msg)
-    server.quit()
+    tail = buf.drain()
+    if tail:
+        yield tail.encode("utf-8")
 
-# ---------------------------------------------------------
-# 🧠 Fetch Yesterday's Transactions (for 7:30 AM IST schedule)
-# ---------------------------------------------------------
-def fetch_yesterday_transactions():
-    # Server is in UTC, job runs at 02:00 UTC (7:30 AM IST).
-    # At that time date.today() is the *current* IST date,
-    # so yesterday = immediate previous IST calendar date.
-    yesterday = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
-
-    d1 = fetch_provider_data(yesterday, "pinelabs")
-    d2 = fetch_provider_data(yesterday, "gyftr")
 
-    for t in d1.get("data", []):
-        t["provider"] = "pinelabs"
-    for t in d2.get("data", []):
-        t["provider"] = "gyftr"
+def gzip_stream(chunks):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)   # 31 → gzip framing
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
 
-    all_txns = d1["data"] + d2["data"]
-    return all_txns, yesterday
 
-# ---------------------------------------------------------
-# 🧠 Enrich Transactions with Balance and Deposit Logic
-# ---------------------------------------------------------
-def enrich_with_balance_and_deposit(transactions, query_date):
-    # Use EXACT SAME LOGIC from voucher_transactions route    
-    pinelabs_txns = [t for t in transactions if t["provider"] == "pinelabs"]
-    pinelabs_sorted = sorted(pinelabs_txns, key=lambda x: datetime.strptime(f"{x['date']} {x['time']}", "%Y-%m-%d %H:%M:%S"))
-
-    prev_closing = get_previous_day_closing_balance(query_date)
-    balance_map = {}
-
-    for i, txn in enumerate(pinelabs_sorted):
-        # Safe svc balance parse
-        is_success = txn.get("voucher_status") == "SUCCESS"
-        raw_svc = txn.get("svc_balance")
-        svc_balance = float(raw_svc) if is_success and raw_svc not in [None, ""] else None
-
-        # First txn
-        if i == 0:
-            opening = prev_closing
-            closing = svc_balance if svc_balance is not None else opening
-            prev_closing = closing
-            balance_map[txn["order_id"]] = {"opening": opening, "closing": closing, "deposit": 0}
-            continue
+@app.route("/voucher-transactions/export")
+def export_voucher_transactions():
+    """
+    Download a day's (or a from/to range's) dashboard data.
 
-        # Next ones
-        opening = prev_closing
-        closing = svc_balance if svc_balance is not None else opening
-        prev_closing = closing
-
-        # Deposit detection
-        prev_txn = pinelabs_sorted[i - 1]
-        prev_bal = balance_map.get(prev_txn["order_id"], {}).get("closing")
-
-        deposit = 0
-        if (
-            opening is not None and
-            prev_bal is not None and
-            opening > prev_bal and
-            str(txn.get("svc_deduction")) in ["0", "0.0", None, "None"]
-        ):
-            deposit = opening - prev_bal
-
-        balance_map[txn["order_id"]] = {
-            "opening": opening,
-            "closing": closing,
-            "deposit": deposit
-        }
+    Takes the same `date` / `from` / `to` / `provider` query params as
+    /voucher-transactions and reads days through TRANSACTION_CACHE,
+    loading them if needed. CSV rows are streamed in chunks,
+    gzip-encoded when the client accepts it; `format=xlsx` returns
+    an Excel workbook instead.
+    """
+    provider = provider_key(request.args.get("provider"))
+    date_range = requested_range()
 
-    # Attach results
-    for txn in transactions:
-        if txn["provider"] == "pinelabs":
-            bal = balance_map.get(txn["order_id"], {})
-            txn["opening_balance"] = bal.get("opening")
-            txn["closing_balance"] = bal.get("closing")
-            txn["deposit"] = bal.get("deposit", 0)
+    try:
+        if date_range:
+            day = get_voucher_range(*date_range, provider)
+            label = f"{day['from_date']}_to_{day['to_date']}"
         else:
-            txn["opening_balance"] = None
-            txn["closing_balance"] = None
-            txn["deposit"] = None
+            day = get_voucher_day(request.args.get("date", str(date.today())), provider)
+            label = day["query_date"]
+    except ValueError as e:
+        return f"Invalid date: {e}", 400
+
+    if day["failed_providers"] and not day["data"]:
+        return "Could not load transactions from upstream.", 502
+
+    if request.args.get("format") == "xlsx":
+        return send_file(
+            write_excel(day["data"]),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            download_name=f"voucher-transactions-{label}-{provider}.xlsx",
+            as_attachment=True,
+        )
 
-    return transactions
+    filename = f"voucher-transactions-{label}-{provider}.csv"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
 
-# ---------------------------------------------------------
-# 🧠 Fetch Yesterday's Transactions and Generate Report
-# ---------------------------------------------------------
-def send_daily_excel_report(recipients):
-    txns, date_str = fetch_yesterday_transactions()
-    if not txns:
-        return {"status": "No data"}
-
-    txns = enrich_with_balance_and_deposit(txns, date_str)
-    sorted_txns = sorted(txns, key=lambda x: datetime.strptime(f"{x['date']} {x['time']}", "%Y-%m-%d %H:%M:%S"), reverse=True)
-    excel_file = generate_excel(sorted_txns)
-
-    subject = f"Pepmo Daily Transactions Report — {date_str}"
-    body = f"""
-        <h3>Pepmo Daily Report</h3>
-        <p>Attached is the Excel report for <b>{date_str}</b>.</p>
+    body = iter_csv(day["data"])
+    if "gzip" in request.headers.get("Accept-Encoding", "") and request.args.get("gzip") != "0":
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+
+    return Response(body, mimetype="text/csv", headers=headers)
+
+
+@app.route("/voucher-transactions/archive", methods=["GET", "POST"])
+def voucher_archive():
+    """
+    Archive status for `date` per provider (GET), or with POST, thaw the
+    day and drop it from TRANSACTION_CACHE (and any cached range) so the
+    next view re-syncs it from upstream (e.g. after a late refund on a
+    frozen day).
     """
+    try:
+        day = parse_query_date(request.values.get("date", str(date.today()))).isoformat()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
 
-    for email in recipients:
-        send_email_with_attachment(
-            email,
-            subject,
-            body,
-            excel_file,
-            f"Pepmo_Report_{date_str}.xlsx"
-        )
+    if request.method == "POST":
+        for p in ("pinelabs", "gyftr"):
+            txn_archive.thaw(p, day)
+        for p in ("all", "pinelabs", "gyftr"):
+            TRANSACTION_CACHE.pop((day, p))
+        RANGE_CACHE.clear()
 
-    return {"status": "sent"}
+    return jsonify({p: txn_archive.day_info(p, day) for p in ("pinelabs", "gyftr")})
+
+# ---------------------------------------------------------
+# 🧠 Send Email with Attachment
+# ---------------------------------------------------------
+def send_email_with_attachment(to_email, subject, body, file_bytes, filename):
+    with MailDispatcher() as mail:
+        mail.send(to_email, subject, body, [build_attachment(file_bytes, filename)])
 
 # Test route to trigger email sending
 @app.route("/test-send-report")
@@ -604,23 +858,10 @@ def test_send_report():
     recipients = [
         "suraj.sakhare@payppy.co",
     ]
-    result = send_daily_excel_report(recipients)
-    return jsonify(result)
-
-# ---------------------------------------------------------
-# 🧠 Schedule Daily Report at Midnight
-# ---------------------------------------------------------
-def schedule_midnight_report():
-    print("LIVE MODE: Running daily at 00:00")
-    schedule.every().day.at("00:00").do(
-        lambda: send_daily_excel_report([
-            "suraj.sakhare@payppy.co"
-        ])
-    )
-
-    while True:
-        schedule.run_pending()
-        time.sleep(30)
+    # runs in the background; poll the returned status_url
+    job = JOBS.submit("test-send-report", send_daily_excel_report, recipients,
+                      dedup_key="test-send-report")
+    return jsonify({**job, "status_url": url_for("job_status", job_id=job["id"])}), 202
 
 # # ----------------- Helpers -----------------
 # def fmt_money(v):
@@ -681,20 +922,91 @@ def schedule_midnight_report():
 # 🧮 Customer Segregation Dashboard Page
 # --------------------------------------
 CUSTOMER_SEGREGATION_API = (
-    "https://nexus.payppy.app/api/dashboard/v2/customer-segregation"
+    f"{upstream.NEXUS_BASE}/api/dashboard/v2/customer-segregation"
+)
+
+# Ops keep this page open all day but the numbers only move when
+# upstream recomputes them, so the dataset is served from memory and
+# revalidated in the background (conditional GET when upstream sends
+# ETag / Last-Modified). Totals and buckets are built once per change.
+SEGREGATION_FRESH_FOR = int(os.environ.get("SEGREGATION_FRESH_FOR", "300"))   # seconds
+SEGREGATION_MAX_STALE = int(os.environ.get("SEGREGATION_MAX_STALE", "3600"))
+SEGREGATION_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                      "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+SEGREGATION_TOTAL_FIELDS = ("newCustomers", "totalTransactions", "pvrTransactions", "totalVolume")
+# (label, lower bound inclusive, upper bound exclusive) for monthly volume
+VOLUME_BUCKETS = [
+    ("< ₹1L", 0, 100_000),
+    ("₹1L – ₹5L", 100_000, 500_000),
+    ("₹5L – ₹10L", 500_000, 1_000_000),
+    ("₹10L+", 1_000_000, None),
+]
+
+
+def build_segregation_view(rows):
+    """Everything the page needs from the raw monthly rows, computed once."""
+    month_order = {m: i for i, m in enumerate(SEGREGATION_MONTHS)}
+    repeat_keys = sorted(
+        (k for k in (rows[0] if rows else {}) if k.startswith("repeatFrom") and k[-3:] in month_order),
+        key=lambda k: month_order[k[-3:]],
+    )
+
+    totals = {f: 0 for f in SEGREGATION_TOTAL_FIELDS + tuple(repeat_keys)}
+    buckets = [{"label": label, "months": 0, "volume": 0} for label, _, _ in VOLUME_BUCKETS]
+    for row in rows:
+        for f in totals:
+            totals[f] += _num_or_zero(row.get(f))
+        volume = _num_or_zero(row.get("totalVolume"))
+        for bucket, (_, low, high) in zip(buckets, VOLUME_BUCKETS):
+            if volume >= low and (high is None or volume < high):
+                bucket["months"] += 1
+                bucket["volume"] += volume
+                break
+
+    return {
+        "rows": rows,
+        "repeat_keys": repeat_keys,
+        "totals": totals,
+        "buckets": buckets,
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        "etag": None,
+        "last_modified": None,
+    }
+
+
+def fetch_customer_segregation(previous):
+    headers = {}
+    if previous is not None:
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    resp = upstream.get("customer-segregation", CUSTOMER_SEGREGATION_API, headers=headers)
+    if resp.status_code == 304 and previous is not None:
+        return previous
+    if resp.status_code != 200:
+        raise RuntimeError(f"Upstream error {resp.status_code}")
+
+    view = build_segregation_view(resp.json().get("customerSegregation", []) or [])
+    view["etag"] = resp.headers.get("ETag")
+    view["last_modified"] = resp.headers.get("Last-Modified")
+    return view
+
+
+SEGREGATION_DATA = StaleWhileRevalidate(
+    fetch_customer_segregation,
+    fresh_for=SEGREGATION_FRESH_FOR,
+    max_stale=SEGREGATION_MAX_STALE,
+    name="segregation",
 )
 
+
 @app.route("/user-volume-data")
 def customer_segregation():
     try:
-        resp = requests.get(CUSTOMER_SEGREGATION_API, timeout=30)
-        if resp.status_code != 200:
-            return render_template(
-                "customer_segregation.html",
-                error=f"Upstream error {resp.status_code}"
-            )
-        data = resp.json().get("customerSegregation", [])
-        return render_template("customer_segregation.html", data=data)
+        view = SEGREGATION_DATA.get()
+        return render_template("customer_segregation.html", data=view["rows"], view=view)
     except Exception as e:
         return render_template("customer_segregation.html", error=str(e))
 
@@ -702,20 +1014,219 @@ def customer_segregation():
 # --------------------------------------
 # 🧠 User Cohort Analytics Dashboard
 # --------------------------------------
+# The upstream rows are flattened once into columns (one list per
+# field, display values precomputed) and cached until the TTL runs out
+# or /cohort/update succeeds. The page then pulls filtered, sorted
+# pages from /detail-user-data/rows instead of the whole table.
+COHORT_CACHE = TTLCache(max_entries=1)
+COHORT_TTL = int(os.environ.get("COHORT_TTL", "900"))   # seconds
+COHORT_MEMO_MAX = 64   # memoised views / aggregates per table, keyed by free-text q
+COHORT_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                 "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+COHORT_SORT_COLUMNS = {
+    "name": "name_lower",
+    "total_txns": "total_txns",
+    "volume": "volume",
+    "repeat": "repeat",
+    "avg_txn": "avg_txn",
+}
+COHORT_ROW_FIELDS = ("name", "acquisition", "year", "first_txn", "total_txns", "volume",
+                     "active_months", "repeat", "retained", "avg_txn", "segment",
+                     "cohort", "months")
+
+
+def cohort_segment(total):
+    if total >= 3:
+        return "Loyal"
+    if total == 2:
+        return "Returning"
+    if total == 1:
+        return "New"
+    return "-"
+
+
+def build_cohort_table(users):
+    """Flatten upstream cohort rows into columns with display values precomputed."""
+    cols = {f: [] for f in COHORT_ROW_FIELDS + ("name_lower", "user_id")}
+    for u in users:
+        total = u.get("totalTxns") or 0
+        year = u.get("firstTxnYear") or u.get("signupYear")
+        first_txn = u.get("firstTxnMonth") or "-"
+        if u.get("firstTxnYear"):
+            first_txn += f" {u['firstTxnYear']}"
+
+        cols["name"].append(u.get("fullName") or "N/A")
+        cols["name_lower"].append((u.get("fullName") or "").lower())
+        cols["user_id"].append(u.get("userId") or u.get("user_id"))
+        cols["acquisition"].append(u.get("acquisitionMonth") or "-")
+        cols["year"].append(str(year) if year else "-")
+        cols["first_txn"].append(first_txn)
+        cols["total_txns"].append(total)
+        cols["volume"].append(_num_or_zero(u.get("totalVolume")))
+        cols["active_months"].append(", ".join(u.get("activeMonths") or []))
+        cols["repeat"].append(u.get("repeatCount") or 0)
+        cols["retained"].append(total >= 2)
+        cols["avg_txn"].append(_num_or_zero(u.get("avgTxnValue")))
+        cols["segment"].append(cohort_segment(total))
+        cols["cohort"].append(u.get("cohortLabel") or "-")
+        cols["months"].append(u.get("monthlyTxnCounts") or {})
+
+    return {
+        "columns": cols,
+        "count": len(users),
+        "years": sorted({y for y in cols["year"] if y != "-"}),
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        "_views": {},   # (month, year, q, sort, descending) -> row indices
+        "_aggregates": {},
+    }
+
+
+def fetch_cohort_table():
+    resp = upstream.get("user-cohorts", f"{upstream.NEXUS_BASE}/api/dashboard/v2/user-cohorts")
+    if resp.status_code != 200:
+        raise RuntimeError(f"Upstream error {resp.status_code}")
+    return build_cohort_table(resp.json().get("userCohorts", []) or [])
+
+
+def get_cohort_table():
+    return COHORT_CACHE.get_or_load("cohorts", fetch_cohort_table, COHORT_TTL)
+
+
+def cohort_user_ids(table, month=None, year=None, segment=None, cohort=None):
+    """
+    User IDs in the cohort table matching the filters → (ids, rows without an ID).
+
+    `month` is the acquisition month, `segment` New/Returning/Loyal and
+    `cohort` the upstream cohort label; empty filters match everything.
+    """
+    cols = table["columns"]
+    ids, missing = [], 0
+    for i in range(table["count"]):
+        if ((not month or cols["acquisition"][i] == month)
+                and (not year or cols["year"][i] == year)
+                and (not segment or cols["segment"][i] == segment)
+                and (not cohort or cols["cohort"][i] == cohort)):
+            if cols["user_id"][i]:
+                ids.append(str(cols["user_id"][i]))
+            else:
+                missing += 1
+    return ids, missing
+
+
+def cohort_view(table, month, year, q, sort, descending):
+    """Row indices matching the filters in the requested order, memoised on the table."""
+    key = (month, year, q, sort, descending)
+    views = table["_views"]
+    idx = views.get(key)
+    if idx is None:
+        cols = table["columns"]
+        idx = [
+            i for i in range(table["count"])
+            if (not month or cols["acquisition"][i] == month)
+            and (not year or cols["year"][i] == year)
+            and (not q or q in cols["name_lower"][i])
+        ]
+        if sort in COHORT_SORT_COLUMNS:
+            column = cols[COHORT_SORT_COLUMNS[sort]]
+            idx.sort(key=column.__getitem__, reverse=descending)
+        if len(views) > COHORT_MEMO_MAX:
+            views.clear()
+        views[key] = idx
+    # the local, not views[key]: another request may clear the memo meanwhile
+    return idx
+
+
+def cohort_aggregates(table, month, year, q, idx):
+    key = (month, year, q)
+    memo = table["_aggregates"]
+    aggregates = memo.get(key)
+    if aggregates is None:
+        cols = table["columns"]
+        users = len(idx)
+        total_volume = sum(cols["volume"][i] for i in idx)
+        retained = sum(1 for i in idx if cols["retained"][i])
+        segments = {}
+        for i in idx:
+            seg = cols["segment"][i]
+            segments[seg] = segments.get(seg, 0) + 1
+        aggregates = {
+            "users": users,
+            "total_txns": sum(cols["total_txns"][i] for i in idx),
+            "total_volume": round(total_volume, 2),
+            "avg_volume_per_user": round(total_volume / users, 2) if users else 0,
+            "retained": retained,
+            "retention_rate": round(retained * 100 / users, 1) if users else 0,
+            "segments": segments,
+        }
+        if len(memo) > COHORT_MEMO_MAX:
+            memo.clear()
+        memo[key] = aggregates
+    return aggregates
+
+
 @app.route("/detail-user-data")
 def user_cohorts():
     try:
-        # call your API that now returns the precomputed rows
-        resp = requests.get("https://nexus.payppy.app/api/dashboard/v2/user-cohorts", timeout=60)
-        if resp.status_code != 200:
-            return render_template("user_cohorts.html", error=f"Upstream error {resp.status_code}")
-        data = resp.json().get("userCohorts", []) or []
-        return render_template("user_cohorts.html", data=data)
+        table = get_cohort_table()
+        return render_template("user_cohorts.html", total=table["count"],
+                               years=table["years"], months=COHORT_MONTHS,
+                               fetched_at=table["fetched_at"])
     except Exception as e:
         return render_template("user_cohorts.html", error=str(e))
 
 
-API_BASE = "https://nexus.payppy.app/api"
+@app.route("/detail-user-data/rows")
+def user_cohort_rows():
+    """
+    One page of the cohort table as JSON.
+
+    Params: `month` (acquisition month, e.g. Mar), `year`, `q` (name
+    substring), `sort` (name|total_txns|volume|repeat|avg_txn, default
+    upstream order), `dir` (asc|desc), `page`, `per_page`. Aggregates
+    cover every row matching the filters, not just the page.
+    """
+    try:
+        table = get_cohort_table()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    month = request.args.get("month") or None
+    year = request.args.get("year") or None
+    if month == "All":
+        month = None
+    if year == "All":
+        year = None
+    q = (request.args.get("q") or "").strip().lower()
+    sort = request.args.get("sort")
+    descending = request.args.get("dir", "desc") != "asc"
+
+    idx = cohort_view(table, month, year, q, sort, descending)
+
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 25)), 1), MAX_PER_PAGE)
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+
+    start = (page - 1) * per_page
+    cols = table["columns"]
+    rows = [
+        dict({f: cols[f][i] for f in COHORT_ROW_FIELDS}, n=start + n + 1)
+        for n, i in enumerate(idx[start:start + per_page])
+    ]
+
+    return jsonify({
+        "total": len(idx),
+        "page": page,
+        "per_page": per_page,
+        "pages": max(math.ceil(len(idx) / per_page), 1),
+        "rows": rows,
+        "aggregates": cohort_aggregates(table, month, year, q, idx),
+        "fetched_at": table["fetched_at"],
+    })
+
+
+API_BASE = f"{upstream.NEXUS_BASE}/api"
 
 @app.route("/notification", methods=["GET"])
 def notification():
@@ -743,7 +1254,7 @@ def send_to_all():
             "data_payload": data_payload
         }
 
-        resp = requests.post(f"{API_BASE}/notifications/broadcast", json=payload)
+        resp = upstream.post("notifications", f"{API_BASE}/notifications/broadcast", json=payload)
         result = resp.json()
 
         if resp.status_code == 200:
@@ -784,7 +1295,7 @@ def send_to_user():
             "body": body,
             "data_payload": data_payload
         }
-        resp = requests.post(f"{API_BASE}/notifications/user", json=payload)
+        resp = upstream.post("notifications", f"{API_BASE}/notifications/user", json=payload)
         result = resp.json()
         if resp.status_code == 200:
             return render_template("send_notification.html", success_message="✅ Notification sent to user successfully!", result=result)
@@ -794,24 +1305,147 @@ def send_to_user():
         return render_template("send_notification.html", error_message=f"Error: {str(e)}")
     
 
+# ------------------------------------------------
+# 🔹 Send notification to MANY specific users (background job)
+# ------------------------------------------------
+def bulk_recipients(form, files):
+    """Recipients picked on the bulk form → (user_ids, note)."""
+    target = form.get("target", "list")
+    if target == "csv":
+        upload = files.get("user_csv")
+        if not upload or not upload.filename:
+            raise ValueError("Choose a CSV file of user IDs")
+        return bulk_notify.parse_user_csv(upload.read()), None
+    if target == "cohort":
+        ids, missing = cohort_user_ids(
+            get_cohort_table(),
+            month=form.get("cohort_month") or None,
+            year=form.get("cohort_year") or None,
+            segment=form.get("cohort_segment") or None,
+            cohort=form.get("cohort_label") or None,
+        )
+        return ids, f"{missing} cohort users have no user ID and were skipped" if missing else None
+    return bulk_notify.parse_user_ids(form.get("user_ids")), None
+
+
+@app.route("/send/bulk", methods=["POST"])
+def send_to_users():
+    try:
+        data_payload = json.loads(request.form.get("data_payload") or "{}")
+    except json.JSONDecodeError:
+        return render_template("send_notification.html", error_message="❌ Invalid JSON in Data Payload")
+
+    try:
+        user_ids, note = bulk_recipients(request.form, request.files)
+    except Exception as e:
+        return render_template("send_notification.html", error_message=f"Error: {str(e)}")
+    if not user_ids:
+        return render_template("send_notification.html", error_message="❌ No user IDs selected")
+    if len(user_ids) > bulk_notify.MAX_RECIPIENTS:
+        return render_template(
+            "send_notification.html",
+            error_message=f"❌ {len(user_ids)} recipients, the limit is {bulk_notify.MAX_RECIPIENTS}",
+        )
+
+    payload = {
+        "title": request.form.get("title"),
+        "body": request.form.get("body"),
+        "data_payload": data_payload,
+    }
+    options = {}
+    for field, cast in (("concurrency", int), ("rate", float)):
+        try:
+            if request.form.get(field):
+                options[field] = cast(request.form[field])
+        except ValueError:
+            return render_template("send_notification.html", error_message=f"❌ Invalid {field}")
+
+    # the same message to the same users while it is still going out → one job
+    digest = zlib.crc32(json.dumps([payload, user_ids], sort_keys=True).encode())
+    job = JOBS.submit(
+        "notify-bulk", bulk_notify.send_bulk, f"{API_BASE}/notifications/user",
+        user_ids, payload, dedup_key=f"notify-bulk:{digest:08x}", with_progress=True, **options,
+    )
+    return render_template(
+        "send_notification.html", bulk_job=job, bulk_note=note,
+        bulk_done=f"✅ Bulk send to {len(user_ids)} users finished",
+        success_message=f"📣 Sending to {len(user_ids)} users in the background…",
+    )
+
+
+# ------------------------------------------------
+# 🧵 Admin actions run as background jobs
+# ------------------------------------------------
+def upstream_json_job(method, endpoint, url):
+    resp = upstream.request(method, endpoint, url)
+    result = resp.json()
+    if resp.status_code != 200:
+        raise RuntimeError(f"❌ Failed: {result}")
+    return result
+
+
+def cohort_refresh_job(url):
+    result = upstream_json_job("POST", "cohort-refresh", url)
+    # upstream has recomputed the cohorts, so drop ours and warm the new ones
+    COHORT_CACHE.pop("cohorts")
+    try:
+        get_cohort_table()
+    except Exception as e:
+        log.warning("[cohorts] Reload after refresh failed: %s", e)
+    return result
+
+
+BRAND_DETAIL_URLS = {
+    "pinelab": f"{API_BASE}/giftcard",
+    "gyftr": f"{API_BASE}/giftcard?provider=gyftr",
+}
+
+
+def sync_brand_details(source):
+    resp = upstream.get("brand-details", BRAND_DETAIL_URLS[source])
+    if resp.status_code != 200:
+        raise RuntimeError(f"Upstream error {resp.status_code}")
+    brands = resp.json()
+    return brands, brand_store.sync_catalogue(source, brands)
+
+
+def brand_refresh_job(source, url):
+    # upstream refresh trigger, so never retried
+    upstream.get("brands-refresh", url, retries=0)
+
+    # then pull the refreshed details so the result says what changed
+    _, summary = sync_brand_details(source)
+    if summary["added"] or summary["removed"] or summary["changed"]:
+        changes = brand_store.diff(source, summary["version"] - 1, summary["version"])
+        for kind in ("added", "removed", "changed"):
+            summary[f"{kind}_brands"] = [c["name"] or c["product_code"] for c in changes[kind]]
+    return summary
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs")
+def recent_jobs():
+    return jsonify(JOBS.recent())
+
 # ------------------------------------------------
 # 🔹 DELETE Elastic Search data
 # ------------------------------------------------
 @app.route("/elastic/delete", methods=["POST"])
 def delete_elastic():
-    try:
-        resp = requests.delete("https://nexus.payppy.app/api/delete_elastic_data?index=strapi_gift_card_brands")
-        result = resp.json()
-        if resp.status_code == 200:
-            return render_template("send_notification.html", 
-                                   success_elastic="🗑️ Deleted Elastic data successfully!",
-                                   elastic_result=result)
-        else:
-            return render_template("send_notification.html", 
-                                   error_elastic=f"❌ Failed: {result}")
-    except Exception as e:
-        return render_template("send_notification.html", 
-                               error_elastic=f"Error: {str(e)}")
+    job = JOBS.submit(
+        "elastic-delete", upstream_json_job, "DELETE", "elastic",
+        f"{API_BASE}/delete_elastic_data?index=strapi_gift_card_brands",
+        dedup_key="elastic-delete",
+    )
+    return render_template("send_notification.html", elastic_job=job,
+                           elastic_done="🗑️ Deleted Elastic data successfully!")
 
 
 # ------------------------------------------------
@@ -819,38 +1453,26 @@ def delete_elastic():
 # ------------------------------------------------
 @app.route("/elastic/update", methods=["POST"])
 def update_elastic():
-    try:
-        resp = requests.post("https://nexus.payppy.app/api/strapi-data")
-        result = resp.json()
-        if resp.status_code == 200:
-            return render_template("send_notification.html", 
-                                   success_elastic="🔄 Elastic data updated successfully!",
-                                   elastic_result=result)
-        else:
-            return render_template("send_notification.html", 
-                                   error_elastic=f"❌ Failed: {result}")
-    except Exception as e:
-        return render_template("send_notification.html", 
-                               error_elastic=f"Error: {str(e)}")
+    job = JOBS.submit(
+        "elastic-update", upstream_json_job, "POST", "elastic",
+        f"{API_BASE}/strapi-data",
+        dedup_key="elastic-update",
+    )
+    return render_template("send_notification.html", elastic_job=job,
+                           elastic_done="🔄 Elastic data updated successfully!")
 
 # ------------------------------------------------
 # 🔹 Refresh User Cohort Data
 # ------------------------------------------------
 @app.route("/cohort/update", methods=["POST"])
 def update_cohort():
-    try:
-        resp = requests.post("https://nexus.payppy.app/api/dashboard/v2/user-cohorts/refresh")
-        result = resp.json()
-        if resp.status_code == 200:
-            return render_template("send_notification.html",
-                                   success_cohort="📊 User Cohorts refreshed successfully!",
-                                   cohort_result=result)
-        else:
-            return render_template("send_notification.html",
-                                   error_cohort=f"❌ Failed: {result}")
-    except Exception as e:
-        return render_template("send_notification.html",
-                               error_cohort=f"Error: {str(e)}")
+    job = JOBS.submit(
+        "cohort-refresh", cohort_refresh_job,
+        f"{API_BASE}/dashboard/v2/user-cohorts/refresh",
+        dedup_key="cohort-refresh",
+    )
+    return render_template("send_notification.html", cohort_job=job,
+                           cohort_done="📊 User Cohorts refreshed successfully!")
 
 
 # =======================================
@@ -858,12 +1480,12 @@ def update_cohort():
 # =======================================
 @app.route("/brands/pinelabs", methods=["POST"])
 def fetch_pinelabs():
-    try:
-        resp = requests.get("https://nexus.payppy.app/api/fetch-store-brands")
-        return render_template("send_notification.html",
-                               success_brands="📦 Pinelabs Brands refreshed successfully!")
-    except Exception as e:
-        return render_template("send_notification.html", error_brands=str(e))
+    job = JOBS.submit(
+        "brands-refresh-pinelabs", brand_refresh_job, "pinelab", f"{API_BASE}/fetch-store-brands",
+        dedup_key="brands-refresh-pinelabs",
+    )
+    return render_template("send_notification.html", brands_job=job,
+                           brands_done="📦 Pinelabs Brands refreshed successfully!")
 
 
 # =======================================
@@ -871,98 +1493,181 @@ def fetch_pinelabs():
 # =======================================
 @app.route("/brands/gyftr", methods=["POST"])
 def fetch_gyftr():
-    try:
-        resp = requests.get("https://nexus.payppy.app/api/gyftr/fetch-store-brands")
-        return render_template("send_notification.html",
-                               success_brands="🎁 Gyftr Brands refreshed successfully!")
-    except Exception as e:
-        return render_template("send_notification.html", error_brands=str(e))
+    job = JOBS.submit(
+        "brands-refresh-gyftr", brand_refresh_job, "gyftr", f"{API_BASE}/gyftr/fetch-store-brands",
+        dedup_key="brands-refresh-gyftr",
+    )
+    return render_template("send_notification.html", brands_job=job,
+                           brands_done="🎁 Gyftr Brands refreshed successfully!")
 
 
 # =======================================
-# 🔹 Fetch Pinelabs Brand DETAILS
+# 🔹 Fetch Brand DETAILS into the catalogue store
 # =======================================
-@app.route("/brands/details/pinelabs", methods=["POST"])
-def fetch_pinelabs_details():
-    try:
-        resp = requests.get("https://nexus.payppy.app/api/giftcard")
-        result = resp.json()
+BRAND_PREVIEW_ITEMS = 3   # products shown inline; the rest via search / download
 
-        # SAVE JSON TO TEMP FILE
-        filepath = "tmp/pinelab-details.json"
-        with open(filepath, "w") as f:
-            json.dump(result, f, indent=4)
 
-        # store only filename in session
-        session["brand_file"] = filepath
-        session["brand_source"] = "pinelab"
+def fetch_brand_details(source, success_message):
+    try:
+        result, info = sync_brand_details(source)
+        session["brand_source"] = source
 
         return render_template("send_notification.html",
-                               success_brand_details="📦 Pinelabs Brand Details fetched!",
-                               brand_details=result,
-                               brand_source="pinelab")
+                               success_brand_details=success_message,
+                               brand_details=result[:BRAND_PREVIEW_ITEMS],
+                               brand_info=info,
+                               brand_source=source)
 
     except Exception as e:
         return render_template("send_notification.html", error_brand_details=str(e))
 
 
-# =======================================
-# 🔹 Fetch Gyftr Brand DETAILS
-# =======================================
+@app.route("/brands/details/pinelabs", methods=["POST"])
+def fetch_pinelabs_details():
+    return fetch_brand_details("pinelab", "📦 Pinelabs Brand Details fetched!")
+
+
 @app.route("/brands/details/gyftr", methods=["POST"])
 def fetch_gyftr_details():
+    return fetch_brand_details("gyftr", "🎁 Gyftr Brand Details fetched!")
+
+
+# =======================================
+# 🔹 Brand catalogue lookup / search
+# =======================================
+@app.route("/brands/catalogue/<source>")
+def brand_catalogue_search(source):
+    """
+    Search the stored catalogue: `q`, `brand_code`, `category`, `type`,
+    `page`, `per_page`. Returns product summaries; fetch a full record
+    from /brands/catalogue/<source>/<product_code>.
+    """
+    if source not in brand_store.SOURCES:
+        return jsonify({"error": f"Unknown brand source: {source}"}), 404
+    info = brand_store.catalogue_info(source)
+    if info is None:
+        return jsonify({"error": "Catalogue not fetched yet"}), 404
+
     try:
-        resp = requests.get("https://nexus.payppy.app/api/giftcard?provider=gyftr")
-        result = resp.json()
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 50)), 1), MAX_PER_PAGE)
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+
+    total, brands = brand_store.search(
+        source,
+        q=(request.args.get("q") or "").strip() or None,
+        brand_code=request.args.get("brand_code"),
+        category=request.args.get("category"),
+        type=request.args.get("type"),
+        limit=per_page,
+        offset=(page - 1) * per_page,
+    )
+    return jsonify(dict(info, total=total, page=page, per_page=per_page,
+                        pages=max(math.ceil(total / per_page), 1), brands=brands))
 
-        # SAVE JSON TO TEMP FILE
-        filepath = "tmp/gyftr-details.json"
-        with open(filepath, "w") as f:
-            json.dump(result, f, indent=4)
 
-        session["brand_file"] = filepath
-        session["brand_source"] = "gyftr"
+@app.route("/brands/catalogue/<source>/versions")
+def brand_catalogue_versions(source):
+    if source not in brand_store.SOURCES:
+        return jsonify({"error": f"Unknown brand source: {source}"}), 404
+    return jsonify({"source": source, "versions": brand_store.versions(source)})
 
-        return render_template("send_notification.html",
-                               success_brand_details="🎁 Gyftr Brand Details fetched!",
-                               brand_details=result,
-                               brand_source="gyftr")
 
-    except Exception as e:
-        return render_template("send_notification.html", error_brand_details=str(e))
+@app.route("/brands/catalogue/<source>/diff")
+def brand_catalogue_diff(source):
+    """
+    Added / removed / changed products between two snapshot versions.
+    `to` defaults to the latest version and `from` to the one before it.
+    """
+    if source not in brand_store.SOURCES:
+        return jsonify({"error": f"Unknown brand source: {source}"}), 404
+    info = brand_store.catalogue_info(source)
+    if info is None:
+        return jsonify({"error": "Catalogue not fetched yet"}), 404
+
+    try:
+        to_version = int(request.args.get("to", info["version"]))
+        from_version = int(request.args.get("from", to_version - 1))
+    except ValueError:
+        return jsonify({"error": "from and to must be version numbers"}), 400
+    if from_version > to_version:
+        return jsonify({"error": "from must not be after to"}), 400
+
+    changes = brand_store.diff(source, from_version, to_version)
+    return jsonify(dict(
+        changes,
+        source=source,
+        **{"from": from_version, "to": to_version},
+        counts={kind: len(items) for kind, items in changes.items()},
+    ))
+
+
+@app.route("/brands/catalogue/<source>/<path:code>")
+def brand_catalogue_lookup(source, code):
+    if source not in brand_store.SOURCES:
+        return jsonify({"error": f"Unknown brand source: {source}"}), 404
+    brand = brand_store.get_brand(source, code)
+    if brand is None:
+        return jsonify({"error": "Brand not found"}), 404
+    return jsonify(brand)
 
 
 # =======================================
-# 🔹 DOWNLOAD JSON (from file, not session)
+# 🔹 DOWNLOAD JSON (straight from the stored file)
 # =======================================
-@app.route("/brands/details/download", methods=["POST"])
+@app.route("/brands/details/download", methods=["GET", "POST"])
 def download_brand_details_json():
-    filepath = session.get("brand_file")
-    source = session.get("brand_source", "brand-details")
-
-    if not filepath or not os.path.exists(filepath):
+    """
+    Compact JSON is sent as the stored file; `pretty=1` streams an
+    indented copy instead. `source` defaults to the last fetch.
+    """
+    source = request.values.get("source") or session.get("brand_source")
+    if source not in brand_store.SOURCES or brand_store.catalogue_info(source) is None:
         return "No JSON file available to download", 400
 
-    # Load JSON from file
-    with open(filepath, "r") as f:
-        json_data = json.load(f)
-
     timestamp = datetime.now().strftime("%d-%m-%Y-%I-%M-%p")
     filename = f"{timestamp}-{source}-brand-details.json"
 
-    buf = io.BytesIO()
-    buf.write(json.dumps(json_data, indent=4).encode("utf-8"))
-    buf.seek(0)
+    if request.values.get("pretty") == "1":
+        return Response(
+            brand_store.iter_pretty(source),
+            mimetype="application/json",
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
 
     return send_file(
-        buf,
+        os.path.abspath(brand_store.export_path(source)),
         mimetype="application/json",
         download_name=filename,
-        as_attachment=True
+        as_attachment=True,
+        conditional=True,
     )
 
+# =======================================
+# 🔹 Upstream call latency counters
+# =======================================
+@app.route("/upstream-stats")
+def upstream_stats():
+    return jsonify(upstream.stats())
+
+
+# =======================================
+# 🔹 Prometheus metrics
+# =======================================
+metrics.register_cache("transactions", TRANSACTION_CACHE)
+metrics.register_cache("voucher_range", RANGE_CACHE)
+metrics.register_cache("voucher_detail", DETAIL_CACHE)
+metrics.register_cache("referral", REFERRAL_CACHE)
+metrics.register_cache("cohorts", COHORT_CACHE)
+metrics.register_cache("segregation", SEGREGATION_DATA)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    # Start the scheduled report thread
-    #threading.Thread(target=schedule_midnight_report, daemon=True).start()
+    # the daily report runs from scheduler.py
     app.run(host="0.0.0.0", port=3001, debug=True)
 
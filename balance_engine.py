@@ -0,0 +1,138 @@
+import logging, os
+from operator import attrgetter
+
+try:
+    import numpy as np
+except ImportError:   # columnar mode is optional
+    np = None
+
+# ---------------------------------------------------------
+# 🧮 Pinelabs opening / closing / deposit engine
+# ---------------------------------------------------------
+# Shared by the dashboard and the daily Excel report so both give
+# the same numbers. Rows go through in one chronological pass:
+#
+#   opening  = previous closing (or this row's svc_balance when the
+#              day starts with no known previous closing)
+#   closing  = svc_balance, or opening when svc_balance is missing
+#   deposit  = max(closing - (opening - svc_deduction), 0), rounded
+#              to 2dp; None when opening/closing are unknown
+#
+# Rows are txn_rows.TxnRow; svc_balance / svc_deduction are read from
+# the numbers parsed at conversion (svc_balance_num, svc_deduction_num).
+
+COLUMNAR_MIN_ROWS = int(os.environ.get("BALANCE_COLUMNAR_MIN_ROWS", "20000"))
+
+# with DEBUG logging on, every Nth row's balances are logged; the check
+# sits outside the row loop so it costs nothing when DEBUG is off
+LOG_SAMPLE_EVERY = max(int(os.environ.get("BALANCE_LOG_SAMPLE_EVERY", "100")), 1)
+log = logging.getLogger(__name__)
+
+_chronological = attrgetter("_ts")
+
+
+def _deposit(opening, closing, svc_ded):
+    if opening is None or closing is None or svc_ded is None:
+        return None
+    diff = round(closing - (opening - svc_ded), 2)
+    return diff if diff > 0 else 0.0
+
+
+def compute_balances(rows, prev_closing, columnar=None):
+    """
+    Balances for pinelabs `rows` given oldest → newest.
+
+    Returns (openings, closings, deposits), one entry per row.
+    `columnar` forces the NumPy path on/off; by default it is used
+    for days with at least COLUMNAR_MIN_ROWS rows when NumPy exists.
+    """
+    if columnar is None:
+        columnar = np is not None and len(rows) >= COLUMNAR_MIN_ROWS
+    if columnar and np is not None:
+        return _compute_columnar(rows, prev_closing)
+
+    openings, closings, deposits = [], [], []
+    for txn in rows:
+        svc_balance = txn.svc_balance_num
+
+        if prev_closing is None:
+            # first txn of the day with no prev closing
+            opening = closing = svc_balance
+        else:
+            opening = prev_closing
+            closing = opening if svc_balance is None else svc_balance
+
+        openings.append(opening)
+        closings.append(closing)
+        deposits.append(_deposit(opening, closing, txn.svc_deduction_num))
+
+        # move forward only if we have a closing value
+        if closing is not None:
+            prev_closing = closing
+
+    return openings, closings, deposits
+
+
+def _compute_columnar(rows, prev_closing):
+    n = len(rows)
+    svc = np.array([t.svc_balance_num for t in rows], dtype=float)
+    ded = np.array([t.svc_deduction_num for t in rows], dtype=float)
+
+    # closing = svc_balance forward-filled, seeded with the previous closing
+    seeded = np.empty(n + 1)
+    seeded[0] = np.nan if prev_closing is None else prev_closing
+    seeded[1:] = svc
+    idx = np.where(np.isnan(seeded), 0, np.arange(n + 1))
+    np.maximum.accumulate(idx, out=idx)
+    filled = seeded[idx]
+
+    closing = filled[1:]
+    before = filled[:-1]
+    opening = np.where(np.isnan(before), closing, before)
+    diff = closing - (opening - ded)
+
+    openings = [None if v != v else v for v in opening.tolist()]
+    closings = [None if v != v else v for v in closing.tolist()]
+    deposits = []
+    for d in diff.tolist():
+        if d != d:
+            deposits.append(None)
+        else:
+            # Python round keeps results identical to the row-wise path
+            d = round(d, 2)
+            deposits.append(d if d > 0 else 0.0)
+
+    return openings, closings, deposits
+
+
+def apply_balances(transactions, prev_closing, columnar=None):
+    """
+    Set opening_balance / closing_balance / deposit on every row.
+
+    Pinelabs rows are walked oldest → newest with a stable sort, so rows
+    in the same second keep their order in `transactions` (upstream
+    order, which the display sort also keeps). svc_balance is a running
+    balance, so walking ties in reverse would invent deposits. Non
+    pinelabs rows get None. Returns the latest pinelabs closing, or
+    None when there are no pinelabs rows.
+    """
+    pinelabs = sorted((t for t in transactions if t.provider == "pinelabs"), key=_chronological)
+    openings, closings, deposits = compute_balances(pinelabs, prev_closing, columnar)
+
+    for txn, opening, closing, deposit in zip(pinelabs, openings, closings, deposits):
+        txn.opening_balance = opening
+        txn.closing_balance = closing
+        txn.deposit = deposit
+
+    if log.isEnabledFor(logging.DEBUG):
+        for txn in pinelabs[::LOG_SAMPLE_EVERY]:
+            log.debug("Txn %s: Opening=%s, Closing=%s, Deposit=%s", txn.order_id,
+                      txn.opening_balance, txn.closing_balance, txn.deposit)
+
+    for txn in transactions:
+        if txn.provider != "pinelabs":
+            txn.opening_balance = None
+            txn.closing_balance = None
+            txn.deposit = None
+
+    return closings[-1] if closings else None
@@ -0,0 +1,88 @@
+"""
+XLSX generation benchmark: legacy in-memory Workbook vs write-only path.
+
+    python bench/bench_excel.py [rows ...]
+
+Each (mode, rows) case runs in a fresh subprocess so peak RSS is not
+polluted by the previous case.
+"""
+import io, os, random, resource, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_rows(n, seed=1):
+    rnd = random.Random(seed)
+    bal = 1_000_000.0
+    rows = []
+    for i in range(n):
+        sec = i * 86400 // max(n, 1)
+        ded = round(rnd.uniform(100, 1000), 2)
+        bal -= ded
+        rows.append({
+            "date": "2025-01-10",
+            "time": f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}",
+            "order_id": f"ORD-{i:08d}-{rnd.randrange(16**8):08x}",
+            "provider": "pinelabs" if i % 3 else "gyftr",
+            "user_name": f"User {rnd.randrange(5000)}",
+            "brand": rnd.choice(["Amazon", "Zomato", "Myntra", "Swiggy"]),
+            "denomination": "500", "qty": "1",
+            "requested_amount": "500", "paid_by_user": "480.00",
+            "svc_deduction": str(ded),
+            "opening_balance": bal + ded, "closing_balance": bal, "deposit": 0.0,
+            "payment_method": "UPI", "payment_status": "SUCCESS",
+            "voucher_status": "SUCCESS", "refund_status": "N/A",
+            "svc_balance": str(round(bal, 2)),
+        })
+    return rows
+
+
+def legacy_generate_excel(transactions):
+    # generate_excel as it was before the write-only rewrite
+    from openpyxl import Workbook
+    from voucher_pipeline import EXPORT_FIELDS
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Transactions"
+    ws.append(EXPORT_FIELDS)
+    for txn in transactions:
+        ws.append([txn.get(f) for f in EXPORT_FIELDS])
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def run_case(mode, n):
+    import voucher_pipeline
+
+    rows = synthetic_rows(n)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "legacy":
+        size = len(legacy_generate_excel(rows))
+    else:
+        with voucher_pipeline.write_excel(rows) as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:<11}{n:>9,}{n / elapsed:>12,.0f}{elapsed:>9.2f}s"
+          f"{(peak - base_rss) / 1024:>12.1f}MB{size / 1024 / 1024:>9.1f}MB")
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--case":
+        run_case(sys.argv[2], int(sys.argv[3]))
+        return
+
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+    print(f"{'mode':<11}{'rows':>9}{'rows/s':>12}{'time':>10}{'peak RSS +':>14}{'file':>9}")
+    for n in sizes:
+        for mode in ("legacy", "write-only"):
+            subprocess.run([sys.executable, __file__, "--case", mode, str(n)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Voucher pipeline benchmark against the local stub upstream.
+
+    python bench/bench_pipeline.py [--sizes 1000 10000 100000]
+                                   [--cases voucher_transactions enrich ...]
+                                   [--latency-ms 0] [--repeat 1]
+                                   [--save baseline.json]
+                                   [--compare baseline.json --tolerance 0.25]
+
+Cases (each size is the number of rows in the day, all providers):
+    voucher_transactions  cold /voucher-transactions page + first rows page
+    enrich                enrich_with_balance_and_deposit on a fetched day
+    generate_excel        XLSX bytes for an enriched day
+    csv_export            /voucher-transactions/export for a cached day
+    drawer_merge          200 drawer opens (detail fetch + row merge)
+
+The stub upstream (bench/stub_upstream.py) runs in this process; every
+(case, size) runs in a fresh subprocess pointed at it through
+NEXUS_BASE_URL, with its own throwaway closing ledger and transaction
+archive, so peak RSS and caches start clean. Reports wall time, CPU
+time and peak RSS growth.
+With --compare, exits 1 when a case got slower or bigger than the
+saved baseline by more than --tolerance.
+"""
+import argparse, json, os, random, resource, subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+BENCH_DATE = "2025-01-10"
+DRAWER_OPENS = 200
+CASES = ["voucher_transactions", "enrich", "generate_excel", "csv_export", "drawer_merge"]
+
+# differences below these are noise, whatever the relative change
+NOISE_SECONDS = 0.05
+NOISE_MB = 5.0
+
+
+# ---------------------------------------------------------
+# Child side: set up one case, then time run()
+# ---------------------------------------------------------
+def fetched_day(n):
+    import fixtures, voucher_pipeline
+
+    rows = []
+    for provider in ("pinelabs", "gyftr"):
+        day = fixtures.voucher_rows(BENCH_DATE, provider, fixtures.provider_rows(n, provider))
+        for txn in day:
+            txn["provider"] = provider
+        rows += day
+    return voucher_pipeline.normalise_rows(rows)
+
+
+def setup_case(name, n):
+    """Do the untimed setup for a case → (run callable, ops per run)."""
+    import app, voucher_pipeline
+
+    client = app.app.test_client()
+    qs = f"date={BENCH_DATE}&provider=all"
+
+    if name == "voucher_transactions":
+        def run():
+            assert client.get(f"/voucher-transactions?{qs}").status_code == 200
+            assert client.get(f"/voucher-transactions/rows?{qs}&per_page=50").status_code == 200
+        return run, n
+
+    if name == "enrich":
+        rows = fetched_day(n)
+        return (lambda: voucher_pipeline.enrich_with_balance_and_deposit(rows, BENCH_DATE, None)), n
+
+    if name == "generate_excel":
+        rows = voucher_pipeline.enrich_with_balance_and_deposit(fetched_day(n), BENCH_DATE, None)
+        return (lambda: voucher_pipeline.generate_excel(rows)), n
+
+    if name == "csv_export":
+        app.get_voucher_day(BENCH_DATE, "all")
+
+        def run():
+            resp = client.get(f"/voucher-transactions/export?{qs}")
+            assert resp.status_code == 200
+            resp.get_data()
+        return run, n
+
+    if name == "drawer_merge":
+        day = app.get_voucher_day(BENCH_DATE, "all")
+        picks = random.Random(n).sample(day["data"], min(DRAWER_OPENS, len(day["data"])))
+
+        def run():
+            for txn in picks:
+                resp = client.get(
+                    f"/single-voucher-transactions/{txn['user_id']}/{txn['order_id']}"
+                    f"?provider={txn['provider']}&date={BENCH_DATE}&view=all"
+                )
+                assert resp.status_code == 200
+        return run, len(picks)
+
+    raise SystemExit(f"unknown case {name}")
+
+
+def _proc_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def reset_peak_rss():
+    """Reset the RSS high-water mark (Linux) → RSS in KB to measure growth from."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _proc_status_kb("VmRSS")
+    except (OSError, KeyError):
+        # no resettable peak: fall back to growth of the process-lifetime peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_kb():
+    try:
+        return _proc_status_kb("VmHWM")
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # KB on Linux
+
+
+def run_case(name, n):
+    import voucher_pipeline
+
+    run, ops = setup_case(name, n)
+    # archive writes queued during setup run in the background; let them
+    # finish so they are not timed as part of the case
+    voucher_pipeline.ARCHIVE_WRITER.submit(int).result()
+
+    base_rss = reset_peak_rss()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    base_cpu = usage.ru_utime + usage.ru_stime
+    start = time.perf_counter()
+    run()
+    wall = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    print(json.dumps({
+        "case": name,
+        "size": n,
+        "ops": ops,
+        "wall_s": round(wall, 4),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime - base_cpu, 4),
+        "peak_rss_mb": round((peak_rss_kb() - base_rss) / 1024, 1),
+    }))
+
+
+# ---------------------------------------------------------
+# Parent side: stub upstream + one subprocess per case
+# ---------------------------------------------------------
+def measure(base_url, name, n, repeat):
+    """Best (lowest wall time) of `repeat` fresh-process runs."""
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, NEXUS_BASE_URL=base_url, LOG_LEVEL="WARNING",
+                       CLOSING_LEDGER_PATH=os.path.join(tmp, "ledger.db"),
+                       TXN_ARCHIVE_PATH=os.path.join(tmp, "archive.db"))
+            out = subprocess.run(
+                [sys.executable, __file__, "--case", name, str(n)],
+                env=env, cwd=ROOT, check=True, capture_output=True, text=True,
+            ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    return best
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for r in results:
+        key = f"{r['case']}/{r['size']}"
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric, noise in (("wall_s", NOISE_SECONDS), ("peak_rss_mb", NOISE_MB)):
+            limit = base[metric] * (1 + tolerance) + noise
+            if r[metric] > limit:
+                found.append(f"{key} {metric}: {r[metric]} > {base[metric]} (+{tolerance:.0%})")
+    return found
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--case":
+        run_case(sys.argv[2], int(sys.argv[3]))
+        return
+
+    parser = argparse.ArgumentParser(description="Voucher pipeline benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--latency-ms", type=int, default=0, help="stub latency per upstream call")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, best wall time kept")
+    parser.add_argument("--save", help="write results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    import stub_upstream
+
+    stub_upstream.CONFIG["latency_ms"] = args.latency_ms
+    base_url, server = stub_upstream.serve_in_thread()
+
+    print(f"{'case':<22}{'rows':>9}{'wall':>10}{'cpu':>10}{'ops/s':>12}{'peak RSS +':>13}")
+    results = []
+    try:
+        for n in args.sizes:
+            stub_upstream.CONFIG["rows"] = n
+            for name in args.cases:
+                r = measure(base_url, name, n, args.repeat)
+                results.append(r)
+                rate = r["ops"] / r["wall_s"] if r["wall_s"] else 0
+                print(f"{name:<22}{n:>9,}{r['wall_s']:>9.3f}s{r['cpu_s']:>9.3f}s"
+                      f"{rate:>12,.0f}{r['peak_rss_mb']:>11.1f}MB")
+    finally:
+        server.shutdown()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({f"{r['case']}/{r['size']}": r for r in results}, f, indent=2)
+        print(f"baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Synthetic upstream payloads shaped like nexus.payppy.app responses.
+
+Deterministic for a given (date, provider, size) so benchmark runs are
+comparable. Used by the stub upstream and by the in-process cases.
+"""
+import random
+
+BRANDS = ["Amazon", "Zomato", "Myntra", "Swiggy", "Flipkart", "BigBasket", "Nykaa", "PVR"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def provider_rows(total, provider):
+    """Rows of a `total`-row day that belong to `provider` (2/3 pinelabs, 1/3 gyftr)."""
+    pinelabs = total * 2 // 3
+    return pinelabs if provider == "pinelabs" else total - pinelabs
+
+
+def voucher_rows(day, provider, n, users=5000):
+    """`n` upstream voucher rows for one provider/day, in upstream (unsorted) order."""
+    rnd = random.Random(f"{day}/{provider}/{n}")
+    pinelabs = provider == "pinelabs"
+    balance = 10_000_000.0
+    rows = []
+    for i in range(n):
+        sec = i * 86400 // max(n, 1)
+        status = "SUCCESS" if rnd.random() > 0.08 else "FAILED"
+        ded = round(rnd.uniform(100, 2000), 2)
+        if rnd.random() < 0.002:
+            balance += 500_000   # top-up → deposit
+        if status == "SUCCESS":
+            balance -= ded
+        denom = rnd.choice([100, 250, 500, 1000, 2000])
+        qty = rnd.choice([1, 1, 1, 2])
+        rows.append({
+            "order_id": f"{provider[:2].upper()}-{day}-{i:06d}",
+            "user_id": f"u{rnd.randrange(users)}",
+            "date": day,
+            "time": f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}",
+            "user_name": f"User {rnd.randrange(users)}",
+            "brand": rnd.choice(BRANDS),
+            "denomination": denom,
+            "qty": qty,
+            "requested_amount": denom * qty,
+            "paid_by_user": round(denom * qty * 0.97, 2),
+            "svc_deduction": ded if pinelabs else None,
+            "svc_balance": round(balance, 2) if pinelabs and status == "SUCCESS" else None,
+            "payment_method": rnd.choice(["UPI", "UPI", "CARD"]),
+            "payment_status": "SUCCESS",
+            "voucher_status": status,
+            "refund_status": "N/A" if status == "SUCCESS" else rnd.choice(["SUCCESS", "PENDING"]),
+        })
+    rnd.shuffle(rows)
+    return rows
+
+
+def voucher_day(day, provider, n):
+    rows = voucher_rows(day, provider, n)
+    return {
+        "data": rows,
+        "total_amount": round(sum(r["paid_by_user"] for r in rows), 2),
+        "total_volume": sum(r["requested_amount"] for r in rows),
+    }
+
+
+def voucher_detail(user_id, order_id):
+    return {
+        "order_id": order_id,
+        "user": {"id": user_id, "name": f"User {user_id}", "phone": "9999999999"},
+        "coupon_code": f"CPN-{order_id[-6:]}",
+        "pin": "1234",
+        "voucher_status": "SUCCESS",
+        "payment": {"gateway": "razorpay", "reference": f"pay_{order_id[-8:]}"},
+    }
+
+
+def user_cohorts(n=5000):
+    rnd = random.Random(n)
+    users = []
+    for i in range(n):
+        total = rnd.randint(0, 8)
+        counts = {m: rnd.randint(1, 3) for m in rnd.sample(MONTHS, min(total, 3))}
+        users.append({
+            "userId": f"u{i}",
+            "fullName": f"User {i}",
+            "acquisitionMonth": rnd.choice(MONTHS),
+            "firstTxnMonth": rnd.choice(MONTHS) if total else None,
+            "firstTxnYear": rnd.choice([2024, 2025]) if total else None,
+            "signupYear": 2024,
+            "totalTxns": total,
+            "totalVolume": round(total * rnd.uniform(200, 2000), 2),
+            "activeMonths": list(counts),
+            "repeatCount": max(total - 1, 0),
+            "avgTxnValue": round(rnd.uniform(200, 2000), 2) if total else 0,
+            "cohortLabel": f"C{rnd.randint(1, 6)}",
+            "monthlyTxnCounts": counts,
+        })
+    return {"userCohorts": users}
+
+
+def customer_segregation():
+    rnd = random.Random(12)
+    rows = []
+    for i, month in enumerate(MONTHS):
+        row = {
+            "month": month,
+            "totalTransactingCustomers": rnd.randint(500, 5000),
+            "newCustomers": rnd.randint(100, 2000),
+            "totalTransactions": rnd.randint(2000, 20000),
+            "pvrTransactions": rnd.randint(0, 500),
+            "totalVolume": rnd.randint(50_000, 5_000_000),
+        }
+        for prev in MONTHS[:i]:
+            row[f"repeatFrom{prev}"] = rnd.randint(0, 400)
+        rows.append(row)
+    return {"customerSegregation": rows}
+
+
+def referral_dashboard(code):
+    rnd = random.Random(code)
+    days = sorted(rnd.sample(range(1, 29), rnd.randint(0, 6)))
+    by_date = [{"date": f"2025-01-{d:02d}", "count": rnd.randint(1, 5)} for d in days]
+    return {
+        "referral_code": code,
+        "referrer_email": f"{code.lower()}@example.com",
+        "referrals_count": sum(r["count"] for r in by_date),
+        "referrals_by_date": by_date,
+    }
+
+
+def brand_catalogue(provider, n=250):
+    rnd = random.Random(provider)
+    if provider == "gyftr":
+        return [{
+            "BrandProductCode": f"GY{i:05d}",
+            "BrandName": f"Brand {i}",
+            "Brandtype": rnd.choice(["VOUCHER", "OTT", "PROMOCODE"]),
+            "Category": ",".join(rnd.sample(["Gifting", "Food & Beverages", "Lifestyle", "Online"], 2)),
+            "denominationList": "250,500,1000",
+            "updated_at": "Fri, 21 Nov 2025 10:40:27 GMT",
+        } for i in range(n)]
+    return [{
+        "sku": f"EGCGB{i:05d}",
+        "brandCode": f"Brand-{i // 3}",
+        "brandName": f"Brand {i // 3}",
+        "name": f"Brand {i // 3} E-Gift Card",
+        "type": rnd.choice(["DIGITAL", "PHYSICAL"]),
+        "corporateDiscounts": {"discount": [{"amount": rnd.randint(1, 12)}]},
+        "discounts": [],
+        "price": {"denominations": ["500", "1000"]},
+    } for i in range(n)]
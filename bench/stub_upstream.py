@@ -0,0 +1,167 @@
+"""
+Local stand-in for nexus.payppy.app, for benchmarks and offline work.
+
+    python bench/stub_upstream.py [--port 5055] [--rows 10000]
+                                  [--latency-ms 0] [--fixtures DIR]
+    NEXUS_BASE_URL=http://127.0.0.1:5055 python app.py
+
+Serves synthetic voucher-transaction days (`--rows` per day, split
+2/3 pinelabs, 1/3 gyftr), voucher details, user cohorts, customer
+segregation and brand catalogues; admin actions just return ok.
+
+Recorded payloads take precedence when present in `--fixtures`:
+    voucher-transactions-<provider>.json   any date
+    voucher-transactions-<provider>-<YYYY-MM-DD>.json
+    user-cohorts.json, customer-segregation.json
+    giftcard-pinelab.json, giftcard-gyftr.json
+The brand catalogues also fall back to the recorded tmp/*-details.json
+files in the repo.
+
+Size and latency can be changed on a running stub:
+    POST /_stub/config {"rows": 100000, "latency_ms": 50}
+"""
+import argparse, json, os, sys, threading, time
+from functools import lru_cache
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDED_BRANDS = {
+    "pinelab": os.path.join(ROOT, "tmp", "pinelab-details.json"),
+    "gyftr": os.path.join(ROOT, "tmp", "gyftr-details.json"),
+}
+
+CONFIG = {"rows": 1000, "latency_ms": 0, "fixtures": None}
+_config_lock = threading.Lock()
+
+stub = Flask(__name__)
+
+
+def _delay():
+    if CONFIG["latency_ms"]:
+        time.sleep(CONFIG["latency_ms"] / 1000)
+
+
+def _recorded(*names):
+    """Bytes of the first recorded fixture that exists, or None."""
+    for name in names:
+        if name and CONFIG["fixtures"]:
+            path = os.path.join(CONFIG["fixtures"], name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read()
+    return None
+
+
+def _json_bytes(body):
+    return Response(body, mimetype="application/json")
+
+
+@lru_cache(maxsize=16)
+def _voucher_day_bytes(day, provider, rows):
+    # generating and encoding 100k rows is slow; repeat calls are served from here
+    payload = fixtures.voucher_day(day, provider, fixtures.provider_rows(rows, provider))
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+@lru_cache(maxsize=2)
+def _cohort_bytes():
+    return json.dumps(fixtures.user_cohorts()).encode()
+
+
+@stub.route("/api/dashboard/v2/voucher-transactions")
+def voucher_transactions():
+    _delay()
+    day = request.args.get("date", "")
+    provider = request.args.get("provider") or "pinelabs"
+    recorded = _recorded(f"voucher-transactions-{provider}-{day}.json",
+                         f"voucher-transactions-{provider}.json")
+    return _json_bytes(recorded or _voucher_day_bytes(day, provider, CONFIG["rows"]))
+
+
+@stub.route("/api/dashboard/v2/voucher-transactions/<user_id>/<order_id>")
+def voucher_detail(user_id, order_id):
+    _delay()
+    return jsonify(fixtures.voucher_detail(user_id, order_id))
+
+
+@stub.route("/api/dashboard/v2/user-cohorts")
+def user_cohorts():
+    _delay()
+    return _json_bytes(_recorded("user-cohorts.json") or _cohort_bytes())
+
+
+@stub.route("/api/dashboard/v2/customer-segregation")
+def customer_segregation():
+    _delay()
+    recorded = _recorded("customer-segregation.json")
+    return _json_bytes(recorded) if recorded else jsonify(fixtures.customer_segregation())
+
+
+@stub.route("/api/giftcard")
+def giftcard():
+    _delay()
+    source = "gyftr" if request.args.get("provider") == "gyftr" else "pinelab"
+    recorded = _recorded(f"giftcard-{source}.json")
+    if recorded is None and os.path.exists(RECORDED_BRANDS[source]):
+        with open(RECORDED_BRANDS[source], "rb") as f:
+            recorded = f.read()
+    return _json_bytes(recorded) if recorded else jsonify(fixtures.brand_catalogue(source))
+
+
+@stub.route("/api/referral-dashboard/<code>")
+def referral(code):
+    _delay()
+    if code.upper().startswith("MISSING"):
+        return jsonify({"error": "Referral code not found"}), 404
+    return jsonify(fixtures.referral_dashboard(code))
+
+
+@stub.route("/api/<path:path>", methods=["GET", "POST", "DELETE"])
+def admin_action(path):
+    # notifications, elastic, cohort / brand refresh triggers
+    _delay()
+    return jsonify({"ok": True, "path": path})
+
+
+@stub.route("/_stub/config", methods=["GET", "POST"])
+def config():
+    if request.method == "POST":
+        body = request.get_json(force=True)
+        with _config_lock:
+            for key in ("rows", "latency_ms"):
+                if key in body:
+                    CONFIG[key] = int(body[key])
+    return jsonify(CONFIG)
+
+
+def serve_in_thread(host="127.0.0.1", port=0):
+    """Start the stub on a background thread → (base_url, server)."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass   # one access log line per call would swamp benchmark output
+
+    server = make_server(host, port, stub, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://{host}:{server.server_port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--rows", type=int, default=CONFIG["rows"])
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--fixtures", help="directory of recorded payloads")
+    args = parser.parse_args()
+
+    CONFIG.update(rows=args.rows, latency_ms=args.latency_ms, fixtures=args.fixtures)
+    stub.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+import hashlib, json, os, sqlite3, threading
+from datetime import datetime
+
+# ---------------------------------------------------------
+# 🏷️ Gift card brand catalogue store
+# ---------------------------------------------------------
+# Each fetched catalogue is kept twice:
+#   * SQLite rows (one per product, compact JSON doc) indexed by
+#     product code, brand code and name for lookup / search / filter
+#   * a compact JSON file per source, rewritten only when the
+#     catalogue changes, so the download is a plain send_file from disk
+#
+# Pinelabs products are keyed by `sku` (`brandCode` is shared by
+# several products and often missing); Gyftr by `BrandProductCode`.
+#
+# Every product row carries a content hash. A sync compares hashes and
+# only writes the products that were added, removed or changed; each
+# sync that changes something becomes a new snapshot version with its
+# change list kept in `brand_change` for the diff endpoint.
+
+STORE_PATH = os.environ.get("BRAND_STORE_PATH", "tmp/brand-catalogue.db")
+EXPORT_DIR = os.environ.get("BRAND_EXPORT_DIR", "tmp/brands")
+
+SOURCES = {
+    "pinelab": {
+        "product_code": lambda b: b.get("sku") or b.get("id"),
+        "brand_code": lambda b: b.get("brandCode"),
+        "name": lambda b: b.get("brandName") or b.get("name"),
+        "category": lambda b: None,
+        "type": lambda b: b.get("type"),
+    },
+    "gyftr": {
+        "product_code": lambda b: b.get("BrandProductCode"),
+        "brand_code": lambda b: b.get("BrandProductCode"),
+        "name": lambda b: b.get("BrandName"),
+        "category": lambda b: b.get("Category"),
+        "type": lambda b: b.get("Brandtype"),
+    },
+}
+
+SUMMARY_FIELDS = ("product_code", "brand_code", "name", "category", "type")
+
+# top-level fields whose old/new values are kept in the change log
+DISCOUNT_FIELDS = ("discounts", "corporateDiscounts", "campaigns", "price",
+                   "denominationList", "MinValue", "MaxValue")
+
+SCHEMA_VERSION = 2
+CHANGE_HISTORY_VERSIONS = 50   # snapshots kept per source
+
+_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(STORE_PATH, timeout=10)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        # the store only mirrors upstream, so an old layout is rebuilt
+        # on the next sync rather than migrated
+        conn.executescript(
+            """
+            DROP TABLE IF EXISTS brand;
+            DROP TABLE IF EXISTS catalogue;
+            DROP TABLE IF EXISTS snapshot;
+            DROP TABLE IF EXISTS brand_change;
+            """
+        )
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS brand (
+            source       TEXT NOT NULL,
+            product_code TEXT NOT NULL,
+            position     INTEGER NOT NULL,
+            brand_code   TEXT,
+            name         TEXT,
+            name_lower   TEXT,
+            category     TEXT,
+            type         TEXT,
+            hash         TEXT NOT NULL,
+            doc          TEXT NOT NULL,
+            PRIMARY KEY (source, product_code)
+        );
+        CREATE INDEX IF NOT EXISTS brand_position ON brand (source, position);
+        CREATE INDEX IF NOT EXISTS brand_code ON brand (source, brand_code);
+        CREATE TABLE IF NOT EXISTS catalogue (
+            source     TEXT PRIMARY KEY,
+            count      INTEGER NOT NULL,
+            version    INTEGER NOT NULL,
+            fetched_at TEXT NOT NULL,
+            checked_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshot (
+            source     TEXT NOT NULL,
+            version    INTEGER NOT NULL,
+            fetched_at TEXT NOT NULL,
+            count      INTEGER NOT NULL,
+            added      INTEGER NOT NULL,
+            removed    INTEGER NOT NULL,
+            changed    INTEGER NOT NULL,
+            PRIMARY KEY (source, version)
+        );
+        CREATE TABLE IF NOT EXISTS brand_change (
+            source       TEXT NOT NULL,
+            version      INTEGER NOT NULL,
+            product_code TEXT NOT NULL,
+            name         TEXT,
+            change       TEXT NOT NULL,
+            detail       TEXT,
+            PRIMARY KEY (source, version, product_code)
+        );
+        """
+    )
+    return conn
+
+
+def content_hash(brand):
+    """Stable hash of a product record (key order does not matter)."""
+    canonical = json.dumps(brand, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _field_changes(old, new):
+    """Changed top-level fields, with old/new values for the discount-like ones."""
+    fields = sorted(k for k in old.keys() | new.keys() if old.get(k) != new.get(k))
+    discounts = {
+        k: {"old": old.get(k), "new": new.get(k)}
+        for k in fields if k in DISCOUNT_FIELDS
+    }
+    return {"fields": fields, "discounts": discounts}
+
+
+def _check_source(source):
+    if source not in SOURCES:
+        raise ValueError(f"Unknown brand source: {source}")
+
+
+def export_path(source):
+    _check_source(source)
+    return os.path.join(EXPORT_DIR, f"{source}.json")
+
+
+def _write_export(source, conn):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = export_path(source)
+    docs = conn.execute(
+        "SELECT doc FROM brand WHERE source = ? ORDER BY position", (source,)
+    )
+    # compact file for downloads, swapped in atomically
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("[" + ",".join(doc for (doc,) in docs) + "]")
+    os.replace(path + ".tmp", path)
+
+
+def sync_catalogue(source, brands):
+    """
+    Bring the stored catalogue for `source` in line with `brands`.
+
+    Only added / removed / changed products are written. Returns
+    {"source", "version", "count", "added", "removed", "changed",
+    "fetched_at"}; `version` only moves when something changed.
+    """
+    _check_source(source)
+    fields = SOURCES[source]
+    now = datetime.now().isoformat(timespec="seconds")
+
+    incoming = {}   # product_code -> (position, brand, hash)
+    for position, brand in enumerate(brands):
+        code = fields["product_code"](brand) or f"#{position}"
+        incoming[str(code)] = (position, brand, content_hash(brand))
+
+    with _lock:
+        conn = _connect()
+        try:
+            stored = {
+                code: (position, hash_)
+                for code, position, hash_ in conn.execute(
+                    "SELECT product_code, position, hash FROM brand WHERE source = ?", (source,)
+                )
+            }
+            info = conn.execute(
+                "SELECT version, fetched_at FROM catalogue WHERE source = ?", (source,)
+            ).fetchone()
+            version, fetched_at = info if info else (0, now)
+
+            added = [c for c in incoming if c not in stored]
+            removed = [c for c in stored if c not in incoming]
+            changed = [c for c in incoming if c in stored and stored[c][1] != incoming[c][2]]
+            moved = [
+                c for c in incoming
+                if c in stored and c not in changed and stored[c][0] != incoming[c][0]
+            ]
+
+            with conn:
+                if added or removed or changed:
+                    version += 1
+                    fetched_at = now
+                    log = []
+                    for code in removed:
+                        name = conn.execute(
+                            "SELECT name FROM brand WHERE source = ? AND product_code = ?",
+                            (source, code),
+                        ).fetchone()[0]
+                        log.append((source, version, code, name, "removed", None))
+                    for code in changed:
+                        old = json.loads(conn.execute(
+                            "SELECT doc FROM brand WHERE source = ? AND product_code = ?",
+                            (source, code),
+                        ).fetchone()[0])
+                        new = incoming[code][1]
+                        log.append((source, version, code, fields["name"](new), "changed",
+                                    json.dumps(_field_changes(old, new))))
+                    for code in added:
+                        log.append((source, version, code, fields["name"](incoming[code][1]),
+                                    "added", None))
+
+                    conn.executemany(
+                        "DELETE FROM brand WHERE source = ? AND product_code = ?",
+                        [(source, c) for c in removed],
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO brand (source, product_code, position, brand_code, "
+                        "name, name_lower, category, type, hash, doc) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [_brand_row(source, c, *incoming[c]) for c in added + changed],
+                    )
+                    conn.executemany(
+                        "INSERT INTO brand_change (source, version, product_code, name, change, detail) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        log,
+                    )
+                    conn.execute(
+                        "INSERT INTO snapshot (source, version, fetched_at, count, added, removed, changed) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (source, version, now, len(incoming), len(added), len(removed), len(changed)),
+                    )
+                    _trim_history(conn, source, version)
+
+                conn.executemany(
+                    "UPDATE brand SET position = ? WHERE source = ? AND product_code = ?",
+                    [(incoming[c][0], source, c) for c in moved],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO catalogue (source, count, version, fetched_at, checked_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (source, len(incoming), version, fetched_at, now),
+                )
+
+            if added or removed or changed or moved or not os.path.exists(export_path(source)):
+                _write_export(source, conn)
+        finally:
+            conn.close()
+
+    return {
+        "source": source,
+        "version": version,
+        "count": len(incoming),
+        "added": len(added),
+        "removed": len(removed),
+        "changed": len(changed),
+        "fetched_at": fetched_at,
+    }
+
+
+def _brand_row(source, code, position, brand, hash_):
+    fields = SOURCES[source]
+    name = fields["name"](brand)
+    return (
+        source, code, position,
+        fields["brand_code"](brand), name, (name or "").lower(),
+        fields["category"](brand), fields["type"](brand),
+        hash_, json.dumps(brand, separators=(",", ":"), ensure_ascii=False),
+    )
+
+
+def _trim_history(conn, source, version):
+    oldest = version - CHANGE_HISTORY_VERSIONS
+    conn.execute("DELETE FROM snapshot WHERE source = ? AND version <= ?", (source, oldest))
+    conn.execute("DELETE FROM brand_change WHERE source = ? AND version <= ?", (source, oldest))
+
+
+def catalogue_info(source):
+    """{"source", "count", "version", "fetched_at", "checked_at"}, or None."""
+    _check_source(source)
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT count, version, fetched_at, checked_at FROM catalogue WHERE source = ?",
+            (source,),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None or not os.path.exists(export_path(source)):
+        return None
+    return dict(zip(("count", "version", "fetched_at", "checked_at"), row), source=source)
+
+
+def versions(source, limit=20):
+    """Recent snapshots, newest first."""
+    _check_source(source)
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT version, fetched_at, count, added, removed, changed FROM snapshot "
+            "WHERE source = ? ORDER BY version DESC LIMIT ?",
+            (source, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    keys = ("version", "fetched_at", "count", "added", "removed", "changed")
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def diff(source, from_version, to_version):
+    """
+    Net changes between two snapshot versions (from_version exclusive).
+
+    A product added and later removed inside the range is dropped; one
+    added then changed counts as added. Changed products list the
+    fields that moved and old/new values of the discount-like ones.
+    """
+    _check_source(source)
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT version, product_code, name, change, detail FROM brand_change "
+            "WHERE source = ? AND version > ? AND version <= ? ORDER BY version",
+            (source, from_version, to_version),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    net = {}   # product_code -> {"code", "name", "change", "fields", "discounts"}
+    for _, code, name, change, detail in rows:
+        entry = net.get(code)
+        if entry is None:
+            entry = net[code] = {"product_code": code, "name": name, "change": change,
+                                 "fields": [], "discounts": {}}
+        elif change == "removed":
+            if entry["change"] == "added":
+                del net[code]
+                continue
+            entry["change"] = "removed"
+        elif change == "added":
+            # removed earlier in the range and back again
+            entry["change"] = "changed"
+        entry["name"] = name or entry["name"]
+
+        if detail:
+            detail = json.loads(detail)
+            entry["fields"] = sorted(set(entry["fields"]) | set(detail["fields"]))
+            for field, values in detail["discounts"].items():
+                if field in entry["discounts"]:
+                    entry["discounts"][field]["new"] = values["new"]
+                else:
+                    entry["discounts"][field] = values
+
+    result = {"added": [], "removed": [], "changed": []}
+    for entry in net.values():
+        kind = entry.pop("change")
+        if kind != "changed":
+            entry.pop("fields")
+            entry.pop("discounts")
+        result[kind].append(entry)
+    return result
+
+
+def get_brand(source, code):
+    """Full upstream record by product code (sku / BrandProductCode), or None."""
+    _check_source(source)
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT doc FROM brand WHERE source = ? AND product_code = ?",
+            (source, code),
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def search(source, q=None, brand_code=None, category=None, type=None, limit=50, offset=0):
+    """
+    (total, [summary, ...]) for products matching every given filter.
+
+    `q` matches name, product code or brand code (case-insensitive
+    substring); `category` matches one entry of Gyftr's comma-separated
+    Category; `brand_code` and `type` are exact.
+    """
+    _check_source(source)
+    where, params = ["source = ?"], [source]
+    if q:
+        like = f"%{q.lower()}%"
+        where.append("(name_lower LIKE ? OR lower(product_code) LIKE ? OR lower(brand_code) LIKE ?)")
+        params += [like, like, like]
+    if brand_code:
+        where.append("brand_code = ?")
+        params.append(brand_code)
+    if category:
+        where.append("instr(',' || category || ',', ?) > 0")
+        params.append(f",{category},")
+    if type:
+        where.append("type = ?")
+        params.append(type)
+    clause = " AND ".join(where)
+
+    conn = _connect()
+    try:
+        total = conn.execute(f"SELECT count(*) FROM brand WHERE {clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(SUMMARY_FIELDS)} FROM brand WHERE {clause} "
+            "ORDER BY position LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+    finally:
+        conn.close()
+    return total, [dict(zip(SUMMARY_FIELDS, r)) for r in rows]
+
+
+def iter_pretty(source, indent=4):
+    """
+    Stream the catalogue as indented JSON, one product at a time.
+
+    Output matches json.dumps(catalogue, indent=indent) without ever
+    holding the whole catalogue in memory.
+    """
+    _check_source(source)
+    pad = " " * indent
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "SELECT doc FROM brand WHERE source = ? ORDER BY position", (source,)
+        )
+        first = True
+        for (doc,) in cursor:
+            item = json.dumps(json.loads(doc), indent=indent).replace("\n", "\n" + pad)
+            yield ("[\n" if first else ",\n") + pad + item
+            first = False
+        yield "[]" if first else "\n]"
+    finally:
+        conn.close()
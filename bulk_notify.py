@@ -0,0 +1,153 @@
+import csv, io, logging, os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from urllib3.exceptions import NewConnectionError
+import upstream
+
+# ---------------------------------------------------------
+# 📣 Bulk targeted notifications
+# ---------------------------------------------------------
+# Sends one /notifications/user call per recipient through a bounded
+# worker pool, paced by a shared rate limit. Recipients go out in
+# batches; after each batch the progress callback gets the running
+# totals (the admin page polls them from /jobs/<id>).
+#
+# Only failures that cannot have been delivered are retried: a connect
+# timeout, a refused / unresolvable connection, and 429/502/503. A read
+# timeout, a connection dropped mid-request or a 504 may already have
+# reached the device, so they are reported as failed instead of sent twice.
+
+CONCURRENCY = int(os.environ.get("NOTIFY_BULK_CONCURRENCY", "8"))
+RATE_PER_SEC = float(os.environ.get("NOTIFY_BULK_RATE", "20"))
+BATCH_SIZE = int(os.environ.get("NOTIFY_BULK_BATCH_SIZE", "100"))
+MAX_RECIPIENTS = int(os.environ.get("NOTIFY_BULK_MAX_RECIPIENTS", "50000"))
+MAX_CONCURRENCY = 32
+SEND_ATTEMPTS = 3
+RETRY_BACKOFF = 1   # seconds, doubled on each attempt
+RETRY_STATUSES = (429, 502, 503)
+FAILURES_KEPT = 100   # failed recipients listed in the result
+
+log = logging.getLogger(__name__)
+
+_ID_SPLIT = re.compile(r"[\s,;]+")
+_ID_HEADERS = ("user_id", "userid", "id", "user")
+
+
+class RateLimiter:
+    """Spaces calls at most `rate` per second across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def _unique(ids):
+    seen = set()
+    return [i for i in ids if i and not (i in seen or seen.add(i))]
+
+
+def parse_user_ids(text):
+    """User IDs from pasted text: one per line, or comma / space separated."""
+    return _unique(_ID_SPLIT.split(text or ""))
+
+
+def parse_user_csv(data):
+    """
+    User IDs from an uploaded CSV (bytes).
+
+    Uses the user_id / userId / id column when the first row is a header,
+    otherwise the first column.
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    rows = [r for r in csv.reader(io.StringIO(text)) if r]
+    if not rows:
+        return []
+    header = [h.strip().lower() for h in rows[0]]
+    column = next((header.index(h) for h in _ID_HEADERS if h in header), None)
+    if column is None:
+        column, body = 0, rows
+    else:
+        body = rows[1:]
+    return _unique(r[column].strip() for r in body if len(r) > column)
+
+
+def _never_sent(error):
+    """True when a requests.ConnectionError happened before the POST went out."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _send_one(url, user_id, payload, limiter, attempts):
+    """→ (ok, retries, error)"""
+    for attempt in range(attempts):
+        limiter.wait()
+        try:
+            resp = upstream.post("notifications", url, json={**payload, "user_id": user_id})
+        except requests.ConnectionError as e:
+            error = f"connection error: {e}"
+            if not _never_sent(e):
+                return False, attempt, f"{error} (not retried, may have been delivered)"
+        except requests.Timeout:
+            return False, attempt, "timed out (not retried, may have been delivered)"
+        else:
+            if resp.status_code == 200:
+                return True, attempt, None
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if resp.status_code not in RETRY_STATUSES:
+                return False, attempt, error
+        if attempt + 1 < attempts:
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+    return False, attempts - 1, error
+
+
+def send_bulk(url, user_ids, payload, progress=None, concurrency=CONCURRENCY,
+              rate=RATE_PER_SEC, batch_size=BATCH_SIZE, attempts=SEND_ATTEMPTS):
+    """
+    Send `payload` to every user in `user_ids` → summary dict.
+
+    `progress`, when given, is called after each batch with the same
+    counters the summary ends up with.
+    """
+    concurrency = min(max(int(concurrency), 1), MAX_CONCURRENCY)
+    limiter = RateLimiter(rate)
+    batches = max((len(user_ids) + batch_size - 1) // batch_size, 1)
+    state = {
+        "total": len(user_ids), "sent": 0, "failed": 0, "retried": 0,
+        "batch": 0, "batches": batches, "concurrency": concurrency, "rate_per_sec": rate,
+    }
+    failures = []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="notify") as pool:
+        for b in range(0, len(user_ids), batch_size):
+            batch = user_ids[b:b + batch_size]
+            outcomes = pool.map(lambda uid: _send_one(url, uid, payload, limiter, attempts), batch)
+            for user_id, (ok, retries, error) in zip(batch, outcomes):
+                state["retried"] += retries
+                if ok:
+                    state["sent"] += 1
+                else:
+                    state["failed"] += 1
+                    if len(failures) < FAILURES_KEPT:
+                        failures.append({"user_id": user_id, "error": error})
+            state["batch"] += 1
+            state["elapsed_s"] = round(time.perf_counter() - start, 1)
+            if progress:
+                progress(dict(state))
+
+    log.info("[notify-bulk] %s sent, %s failed of %s in %.1fs",
+             state["sent"], state["failed"], state["total"], time.perf_counter() - start)
+    return {**state, "elapsed_s": round(time.perf_counter() - start, 1), "failures": failures}
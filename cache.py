@@ -0,0 +1,233 @@
+import logging, threading, time
+from collections import OrderedDict
+
+# ---------------------------------------------------------
+# 🗃️ Thread-safe LRU cache with per-entry TTL
+# ---------------------------------------------------------
+
+_MISSING = object()
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    LRU cache bounded by entry count and by total weight.
+
+    `weigh(value)` gives an entry's weight (e.g. number of rows) so
+    the cache can be capped by approximate memory rather than only by
+    entry count. Every entry carries its own TTL.
+    """
+
+    def __init__(self, max_entries=128, max_weight=None, weigh=None):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigh = weigh or (lambda value: 1)
+        self._data = OrderedDict()   # key -> (expires_at, weight, value)
+        self._weight = 0
+        self._lock = threading.RLock()
+        self._loading = {}           # key -> lock held while loading
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        return self._get(key, default, count=True)
+
+    def _get(self, key, default, count):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[2]
+
+    def contains(self, key):
+        """True if `key` is cached and fresh; not counted as a hit or miss."""
+        return self._get(key, _MISSING, count=False) is not _MISSING
+
+    def set(self, key, value, ttl):
+        weight = self.weigh(value)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return   # never cache something bigger than the whole cache
+            self._data[key] = (time.monotonic() + ttl, weight, value)
+            self._weight += weight
+            self._evict()
+
+    def get_or_load(self, key, load, ttl):
+        """
+        Return the cached value, or call `load()` once and cache it.
+
+        Concurrent misses on the same key wait for the first loader
+        instead of all hitting upstream. `ttl` may be a number or a
+        function of the loaded value; a TTL of None/0 skips caching.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            value = self._get(key, _MISSING, count=False)
+            if value is not _MISSING:
+                return value
+            try:
+                value = load()
+                seconds = ttl(value) if callable(ttl) else ttl
+                if seconds:
+                    self.set(key, value, seconds)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            return value
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "weight": self._weight,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _drop(self, key):
+        _, weight, _ = self._data.pop(key)
+        self._weight -= weight
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (exp, _, _) in self._data.items() if exp < now]:
+            self._drop(key)
+        while len(self._data) > self.max_entries or (
+            self.max_weight is not None and self._weight > self.max_weight
+        ):
+            self._drop(next(iter(self._data)))
+
+
+# ---------------------------------------------------------
+# ♻️ Single value served stale while it refreshes
+# ---------------------------------------------------------
+class StaleWhileRevalidate:
+    """
+    Holds one slowly-changing dataset.
+
+    `load(previous)` returns the new value; it gets the current value
+    (or None) so it can send conditional headers and hand `previous`
+    back on a 304. Reads inside `fresh_for` seconds are served as is;
+    older reads are still served straight away while one background
+    thread reloads. Past `fresh_for + max_stale` (or with nothing
+    loaded yet) the read waits for the reload.
+    """
+
+    def __init__(self, load, fresh_for, max_stale=None, name="swr"):
+        self._load = load
+        self.fresh_for = fresh_for
+        self.max_stale = max_stale
+        self.name = name
+        self._value = _MISSING
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()        # guards the fields below
+        self._load_lock = threading.Lock()   # one reload at a time
+        self._refreshing = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.last_error = None
+
+    def get(self):
+        with self._lock:
+            value, loaded_at = self._value, self._loaded_at
+            age = time.monotonic() - loaded_at
+            too_old = self.max_stale is not None and age > self.fresh_for + self.max_stale
+            if value is _MISSING or too_old:
+                self.misses += 1
+            elif age > self.fresh_for:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+
+        if value is _MISSING or too_old:
+            return self.refresh(newer_than=loaded_at)
+        if age > self.fresh_for:
+            self._refresh_in_background()
+        return value
+
+    def age(self):
+        """Seconds since the value was last (re)validated, or None."""
+        with self._lock:
+            return None if self._value is _MISSING else time.monotonic() - self._loaded_at
+
+    def refresh(self, newer_than=None):
+        """Reload now; callers that queued behind a reload reuse its result."""
+        with self._load_lock:
+            with self._lock:
+                if newer_than is not None and self._value is not _MISSING \
+                        and self._loaded_at > newer_than:
+                    return self._value
+                previous = None if self._value is _MISSING else self._value
+
+            value = self._load(previous)
+            with self._lock:
+                self._value = value
+                self._loaded_at = time.monotonic()
+                self.refreshes += 1
+                self.last_error = None
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep serving the stale value, try again on a later read
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+                log.warning("[%s] Background refresh failed: %s", self.name, e)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name=f"{self.name}-refresh", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "last_error": self.last_error,
+            }
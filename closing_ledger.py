@@ -0,0 +1,71 @@
+import os, sqlite3, threading
+
+# ---------------------------------------------------------
+# 📒 End-of-day closing balance ledger
+# ---------------------------------------------------------
+# One row per (provider, day). Past days never change, so once a
+# day's closing is known it is served from here (and the in-memory
+# copy in front of it) instead of refetching the whole day.
+
+LEDGER_PATH = os.environ.get("CLOSING_LEDGER_PATH", "tmp/closing-ledger.db")
+
+_lock = threading.Lock()
+_memo = {}   # (provider, "YYYY-MM-DD") -> float
+
+
+def _connect():
+    conn = sqlite3.connect(LEDGER_PATH, timeout=10)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS closing_balance (
+            provider   TEXT NOT NULL,
+            day        TEXT NOT NULL,
+            closing    REAL NOT NULL,
+            order_id   TEXT,
+            recorded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (provider, day)
+        )
+        """
+    )
+    return conn
+
+
+def get_closing(provider, day):
+    """Closing balance for `day` (ISO date string), or None if unknown."""
+    key = (provider, day)
+    if key in _memo:
+        return _memo[key]
+
+    with _lock:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT closing FROM closing_balance WHERE provider = ? AND day = ?",
+                key,
+            ).fetchone()
+        finally:
+            conn.close()
+
+    if row is None:
+        return None
+    _memo[key] = row[0]
+    return row[0]
+
+
+def record_closing(provider, day, closing, order_id=None):
+    """Store a finished day's closing balance. First write wins."""
+    key = (provider, day)
+    if key in _memo:
+        return
+
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO closing_balance (provider, day, closing, order_id) "
+                    "VALUES (?, ?, ?, ?)",
+                    (provider, day, float(closing), order_id),
+                )
+        finally:
+            conn.close()
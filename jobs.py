@@ -0,0 +1,109 @@
+import logging, threading, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# ---------------------------------------------------------
+# 🧵 In-process background job runner
+# ---------------------------------------------------------
+# Slow admin actions and report runs go through here so the web
+# worker can return straight away and the page polls /jobs/<id>.
+
+
+log = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobRunner:
+    """
+    Bounded worker pool with job IDs, status tracking and dedup.
+
+    Submitting with a `dedup_key` that is already queued or running
+    returns the existing job instead of starting a second one. With
+    `with_progress=True` the job function also gets a `progress`
+    callback; whatever it is called with shows up as the job's
+    "progress" field while it runs.
+    """
+
+    def __init__(self, max_workers=4, history=200):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()   # id -> job record, oldest first
+        self._active = {}            # dedup_key -> id while queued/running
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, dedup_key=None, with_progress=False, **kwargs):
+        with self._lock:
+            if dedup_key is not None and dedup_key in self._active:
+                job = dict(self._jobs[self._active[dedup_key]])
+                job["deduplicated"] = True
+                return job
+
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "name": name,
+                "status": "queued",
+                "dedup_key": dedup_key,
+                "created_at": _now(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job["id"]] = job
+            if dedup_key is not None:
+                self._active[dedup_key] = job["id"]
+            self._trim()
+
+        if with_progress:
+            kwargs["progress"] = lambda value: self._set_progress(job["id"], value)
+        self._pool.submit(self._run, job["id"], fn, args, kwargs)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def recent(self, limit=50):
+        with self._lock:
+            return [dict(j) for j in reversed(list(self._jobs.values())[-limit:])]
+
+    def _set_progress(self, job_id, value):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["progress"] = value
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            self._jobs[job_id].update(status="running", started_at=_now())
+
+        outcome = {}
+        try:
+            outcome["result"] = fn(*args, **kwargs)
+            outcome["status"] = "done"
+        except Exception as e:
+            log.exception("Job %s (%s) failed", job_id, fn.__name__)
+            outcome["error"] = str(e)
+            outcome["status"] = "failed"
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(outcome, finished_at=_now())
+            key = job["dedup_key"]
+            if key is not None and self._active.get(key) == job_id:
+                del self._active[key]
+
+    def _trim(self):
+        # drop the oldest finished jobs beyond the history limit
+        excess = len(self._jobs) - self._history
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]["status"] in ("done", "failed"):
+                del self._jobs[job_id]
+                excess -= 1
@@ -0,0 +1,132 @@
+import logging, os, smtplib, socket, time
+from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email import encoders
+
+# ---------------------------------------------------------
+# ✉️ SMTP dispatcher: one session + one encoded attachment per run
+# ---------------------------------------------------------
+# For local testing point it at a debugging server, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
+#   SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0 SMTP_LOGIN=0
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.hostinger.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_USER = os.environ.get("SMTP_USER", "user@pepmo.app")
+SMTP_PASS = os.environ.get("SMTP_PASS", "user@White#Cloud&9357")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") != "0"
+SMTP_LOGIN = os.environ.get("SMTP_LOGIN", "1") != "0"
+SMTP_TIMEOUT = 60
+
+SEND_ATTEMPTS = 3
+RETRY_BACKOFF = 2   # seconds, doubled on each attempt
+
+log = logging.getLogger(__name__)
+
+# connection-level failures → reconnect and retry. Not OSError as a whole:
+# every SMTPException is an OSError, including permanent 5xx replies.
+_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                     ConnectionError, socket.timeout)
+
+
+def _all_temporary(codes):
+    return all(400 <= code < 500 for code in codes)
+
+
+def build_attachment(file_bytes, filename):
+    """Base64-encode an attachment once so it can be reused across messages."""
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(file_bytes)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f"attachment; filename={filename}")
+    return part
+
+
+class MailDispatcher:
+    """
+    Holds one authenticated SMTP session for a batch of messages.
+
+        with MailDispatcher() as mail:
+            part = build_attachment(data, "report.xlsx")
+            results = mail.send_each(recipients, subject, body, [part])
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASS,
+                 starttls=SMTP_STARTTLS, login=SMTP_LOGIN):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.starttls, self.login = starttls, login
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        if self._server is None:
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            if self.starttls:
+                server.starttls()
+            if self.login:
+                server.login(self.user, self.password)
+            self._server = server
+        return self._server
+
+    def _reset(self):
+        if self._server is not None:
+            try:
+                self._server.close()
+            except Exception:
+                pass
+        self._server = None
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+        self._server = None
+
+    def send(self, to_email, subject, body, attachments=()):
+        """Send one message, retrying transient failures on the same session."""
+        msg = MIMEMultipart()
+        msg["From"] = self.user
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "html"))
+        for part in attachments:
+            msg.attach(part)
+
+        for attempt in range(SEND_ATTEMPTS):
+            try:
+                self._connect().send_message(msg)
+                return
+            except _RECONNECT_ERRORS:
+                self._reset()
+                if attempt == SEND_ATTEMPTS - 1:
+                    raise
+            # 4xx is temporary, anything else will not get better
+            except smtplib.SMTPRecipientsRefused as e:
+                if not _all_temporary(code for code, _ in e.recipients.values()) \
+                        or attempt == SEND_ATTEMPTS - 1:
+                    raise
+            except smtplib.SMTPResponseException as e:
+                if not _all_temporary([e.smtp_code]) or attempt == SEND_ATTEMPTS - 1:
+                    raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    def send_each(self, recipients, subject, body, attachments=()):
+        """One message per recipient over this session → {email: "sent" | error}."""
+        results = {}
+        for email in recipients:
+            try:
+                self.send(email, subject, body, attachments)
+                results[email] = "sent"
+            except Exception as e:
+                log.warning("[mail] Failed to send to %s: %s", email, e)
+                results[email] = f"failed: {e}"
+        return results
@@ -0,0 +1,157 @@
+import threading, time
+from contextlib import contextmanager
+
+# ---------------------------------------------------------
+# 📈 In-process metrics, exposed in Prometheus text format
+# ---------------------------------------------------------
+# Per-process only (each gunicorn worker reports its own numbers).
+# Labels are plain keyword arguments; every metric keeps one series
+# per distinct label combination, so only use bounded label values
+# (route templates, endpoint names, stage names).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_caches = {}   # name -> object with .stats() → {"hits", "misses", ...}
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    le = _format_labels(self.labels, key, [f'le="{bound}"'])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = _format_labels(self.labels, key, ['le="+Inf"'])
+                lines.append(f"{self.name}_bucket{inf} {series[-2]}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_count{labels} {series[-2]}")
+                lines.append(f"{self.name}_sum{labels} {round(series[-1], 6)}")
+        return lines
+
+
+HTTP_SECONDS = Histogram(
+    "dashboard_http_request_duration_seconds",
+    "Time to produce a response (headers) per route.",
+    ("route", "method"),
+)
+HTTP_REQUESTS = Counter(
+    "dashboard_http_requests_total", "Responses per route and status.",
+    ("route", "method", "status"),
+)
+UPSTREAM_SECONDS = Histogram(
+    "dashboard_upstream_request_duration_seconds",
+    "Upstream call latency per logical endpoint, one sample per attempt.",
+    ("endpoint", "outcome"),
+)
+UPSTREAM_RETRIES = Counter(
+    "dashboard_upstream_retries_total", "Upstream attempts that were retried.", ("endpoint",),
+)
+STAGE_SECONDS = Histogram(
+    "dashboard_stage_duration_seconds",
+    "Time spent in internal stages (parse, sort, balances, ledger, render, ...).",
+    ("stage",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+@contextmanager
+def stage(name):
+    """Time a block into dashboard_stage_duration_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def register_cache(name, cache):
+    """Report a cache's hit/miss counters (read from cache.stats() at scrape time)."""
+    _caches[name] = cache
+
+
+def _cache_lines():
+    lines = [
+        "# HELP dashboard_cache_requests_total Cache lookups by result.",
+        "# TYPE dashboard_cache_requests_total counter",
+    ]
+    ratios = [
+        "# HELP dashboard_cache_hit_ratio Share of lookups served from the cache.",
+        "# TYPE dashboard_cache_hit_ratio gauge",
+    ]
+    sizes = [
+        "# HELP dashboard_cache_entries Entries currently held.",
+        "# TYPE dashboard_cache_entries gauge",
+    ]
+    for name, cache in sorted(_caches.items()):
+        s = cache.stats()
+        served = s.get("hits", 0) + s.get("stale_hits", 0)
+        lookups = served + s.get("misses", 0)
+        for result in ("hits", "stale_hits", "misses"):
+            if result in s:
+                lines.append(f'dashboard_cache_requests_total{{cache="{name}",result="{result}"}} {s[result]}')
+        ratios.append(f'dashboard_cache_hit_ratio{{cache="{name}"}} {round(served / lookups, 4) if lookups else 0}')
+        if "entries" in s:
+            sizes.append(f'dashboard_cache_entries{{cache="{name}"}} {s["entries"]}')
+    return lines + ratios + sizes
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += _cache_lines()
+    return "\n".join(lines) + "\n"
@@ -1,22 +1,214 @@
-import time
+import fcntl, json, logging, os, time
 import schedule
-from app import send_daily_excel_report
-
-def daily_job():
-    recipients = [
-        "suraj.sakhare@payppy.co",
-        "satyen.aghor@payppy.co",
-        "sakshi.aghor@payppy.co",
-        "mohini.aghor@payppy.co"
-    ]
-    print("Sending daily Excel report…")
-    send_daily_excel_report(recipients)
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from voucher_pipeline import (
+    fetch_report_transactions, enrich_with_balance_and_deposit,
+    generate_excel, send_report_file, day_closing_balance,
+    get_previous_day_closing_balance,
+)
+from mailer import MailDispatcher
+
+log = logging.getLogger("scheduler")
+
+RECIPIENTS = [
+    "suraj.sakhare@payppy.co",
+    "satyen.aghor@payppy.co",
+    "sakshi.aghor@payppy.co",
+    "mohini.aghor@payppy.co"
+]
 
 # 7:30 AM IST = 02:00 UTC
-schedule.every().day.at("02:00").do(daily_job)
+RUN_AT_UTC = "02:00"
+RETRY_EVERY_MINUTES = 60
+MAX_CATCHUP_DAYS = 7
+
+STATE_PATH = "tmp/report-scheduler.json"
+LOCK_PATH = "tmp/report-scheduler.lock"
+
+# seconds each stage may take for one day before that day is failed
+STAGE_TIMEOUTS = {"fetch": 300, "enrich": 120, "render": 300, "send": 300}
+
+# ---------------------------------------------------------
+# 💾 Persisted run state
+# ---------------------------------------------------------
+# {"since": first tracked date, "last_success": "YYYY-MM-DD",
+#  "sent": {date: ts}, "failed": {date: error}}
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"since": None, "last_success": None, "sent": {}, "failed": {}}
+
+
+def save_state(state):
+    # keep the file small: only dates still inside the catch-up window matter
+    cutoff = (date.today() - timedelta(days=MAX_CATCHUP_DAYS * 2)).isoformat()
+    state["sent"] = {d: ts for d, ts in state["sent"].items() if d >= cutoff}
+    state["failed"] = {d: e for d, e in state["failed"].items() if d >= cutoff}
+
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def due_dates(state, now=None):
+    """
+    Report dates inside the catch-up window that have not been sent,
+    oldest first. Nothing before `since` is due, so a fresh install
+    does not mail a week of old reports.
+    """
+    now = now or datetime.utcnow()
+    latest = now.date() - timedelta(days=1)
+    if now.strftime("%H:%M") < RUN_AT_UTC:
+        latest -= timedelta(days=1)   # today's run is not due yet
+
+    since = state.get("since") or latest.isoformat()
+    window = [(latest - timedelta(days=i)).isoformat() for i in range(MAX_CATCHUP_DAYS)]
+    return [d for d in reversed(window) if d >= since and d not in state["sent"]]
+
+# ---------------------------------------------------------
+# 🔒 Overlap protection (works across processes too)
+# ---------------------------------------------------------
+@contextmanager
+def run_lock():
+    with open(LOCK_PATH, "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# ---------------------------------------------------------
+# 🚚 fetch → enrich → render → send, pipelined across days
+# ---------------------------------------------------------
+def run_reports(dates, recipients=RECIPIENTS):
+    """
+    Send the report for each date (oldest first).
+
+    All fetches start at once (bounded pool), enrich runs in date order
+    carrying each day's closing into the next, renders overlap with the
+    sends, and every email goes over one SMTP session. A day that fails
+    any stage is recorded and retried on the next run.
+    """
+    state = load_state()
+    fetch_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="report-fetch")
+    work_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report-work")
+
+    def fail(day, stage, err):
+        log.error("[scheduler] %s: %s failed: %r", day, stage, err)
+        state["failed"][day] = f"{stage}: {err!r}"
+
+    try:
+        # only the oldest day needs a previous-day closing lookup
+        fetches = {
+            d: fetch_pool.submit(fetch_report_transactions, d, i == 0)
+            for i, d in enumerate(dates)
+        }
+
+        renders = []
+        carry_known, carry = False, None
+        for i, d in enumerate(dates):
+            try:
+                txns, prev_closing = fetches[d].result(timeout=STAGE_TIMEOUTS["fetch"])
+                if i > 0:
+                    # previous day's closing, carried forward or looked up
+                    prev_closing = carry if carry_known else get_previous_day_closing_balance(d)
+            except Exception as e:
+                fail(d, "fetch", e)
+                carry_known = False
+                continue
+
+            if not txns:
+                log.info("[scheduler] %s: no data, nothing to send", d)
+                state["sent"][d] = "no-data"
+                carry_known, carry = True, None
+                continue
+
+            try:
+                txns = work_pool.submit(
+                    enrich_with_balance_and_deposit, txns, d, prev_closing
+                ).result(timeout=STAGE_TIMEOUTS["enrich"])
+            except Exception as e:
+                fail(d, "enrich", e)
+                carry_known = False
+                continue
+
+            carry, _ = day_closing_balance([t for t in txns if t["provider"] == "pinelabs"])
+            carry_known = True
+            renders.append((d, work_pool.submit(generate_excel, txns)))
+
+        with MailDispatcher() as mail, ThreadPoolExecutor(max_workers=1) as send_pool:
+            for d, fut in renders:
+                try:
+                    excel_file = fut.result(timeout=STAGE_TIMEOUTS["render"])
+                except Exception as e:
+                    fail(d, "render", e)
+                    continue
+
+                try:
+                    result = send_pool.submit(
+                        send_report_file, mail, recipients, d, excel_file
+                    ).result(timeout=STAGE_TIMEOUTS["send"])
+                except TimeoutError as e:
+                    # the stuck send still owns the SMTP session; retry the rest next run
+                    fail(d, "send", e)
+                    break
+                except Exception as e:
+                    fail(d, "send", e)
+                    continue
+
+                if result["status"] == "failed":
+                    fail(d, "send", result["recipients"])
+                    continue
+                log.info("[scheduler] %s: %s", d, result["status"])
+                state["sent"][d] = datetime.utcnow().isoformat(timespec="seconds")
+                state["failed"].pop(d, None)
+                state["last_success"] = max(d, state["last_success"] or d)
+    finally:
+        fetch_pool.shutdown(wait=False)
+        work_pool.shutdown(wait=False)
+        save_state(state)
+
+
+def catch_up():
+    with run_lock() as acquired:
+        if not acquired:
+            log.warning("[scheduler] Previous run still in progress, skipping")
+            return
+        state = load_state()
+        dates = due_dates(state)
+        if not state.get("since") and dates:
+            state["since"] = dates[0]
+            save_state(state)
+        if not dates:
+            return
+        log.info("[scheduler] Sending daily Excel report for %s…", ", ".join(dates))
+        run_reports(dates)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+    )
+    os.makedirs("tmp", exist_ok=True)
+    log.info("Pepmo Scheduler started…")
+
+    # backfill anything missed while the process was down
+    catch_up()
 
-print("Pepmo Scheduler started…")
+    schedule.every().day.at(RUN_AT_UTC).do(catch_up)
+    schedule.every(RETRY_EVERY_MINUTES).minutes.do(catch_up)
 
-while True:
-    schedule.run_pending()
-    time.sleep(30)
\ No newline at end of file
+    while True:
+        schedule.run_pending()
+        time.sleep(30)
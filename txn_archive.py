@@ -0,0 +1,264 @@
+import os, sqlite3, threading
+from datetime import date, datetime, timedelta
+from operator import attrgetter
+from txn_rows import UPSTREAM_FIELDS, TxnRow
+
+# ---------------------------------------------------------
+# 🗄️ Local voucher transaction archive
+# ---------------------------------------------------------
+# One SQLite row per upstream transaction, per (provider, day), holding
+# the projected fields a TxnRow is built from, plus the day's upstream
+# totals and HTTP validators.
+#
+#   past days   frozen once synced after the day ended (+ FREEZE_GRACE);
+#               a frozen day is served from here without calling upstream
+#   today       re-synced on every load: the upstream payload is diffed
+#               against the archive by order_id and only inserted,
+#               changed or vanished rows are written. The voucher API
+#               has no "since" filter, so the day is still downloaded
+#               unless upstream answers the conditional GET with a 304.
+#
+# The diff compares against an in-memory (order_id → rowid, row hash)
+# map of each unfrozen day, rebuilt from SQLite only when the day's
+# revision moved on (another worker synced it) or after a restart.
+#
+# Rows are read back in insertion order, which for a day archived in
+# one sync is upstream order; rows that appear later go to the end (the
+# dashboard sorts by time anyway).
+
+ARCHIVE_PATH = os.environ.get("TXN_ARCHIVE_PATH", "tmp/txn-archive.db")
+ENABLED = os.environ.get("TXN_ARCHIVE", "1") != "0"
+FREEZE_GRACE = timedelta(seconds=int(os.environ.get("TXN_ARCHIVE_FREEZE_GRACE", "3600")))
+KEEP_DAYS = int(os.environ.get("TXN_ARCHIVE_KEEP_DAYS", "400"))   # since archived; 0 keeps all
+
+SCHEMA_VERSION = 1
+
+# writes (and _live) are serialised in-process; reads take no Python
+# lock and rely on WAL, so a running sync never blocks a request's lookup
+_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_columns = ", ".join(UPSTREAM_FIELDS)
+_txn_values = attrgetter(*UPSTREAM_FIELDS)
+_live = {}   # (provider, day) -> (revision, {(key, dup): (rowid, hash)}) for unfrozen days
+
+
+def _connect():
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn = sqlite3.connect(ARCHIVE_PATH, timeout=30)
+                try:
+                    _create_schema(conn)
+                finally:
+                    conn.close()
+                _schema_ready = True
+    return sqlite3.connect(ARCHIVE_PATH, timeout=30)
+
+
+def _create_schema(conn):
+    conn.execute("PRAGMA journal_mode = WAL")   # readers never wait for a sync
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        # only mirrors upstream, so an old layout is rebuilt, not migrated
+        conn.executescript("DROP TABLE IF EXISTS txn; DROP TABLE IF EXISTS archive_day;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    # data columns are untyped so values come back exactly as upstream sent
+    # them (500 stays an int, "500.00" stays a string)
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS txn (
+            provider TEXT NOT NULL,
+            day      TEXT NOT NULL,
+            key      TEXT NOT NULL,
+            dup      INTEGER NOT NULL,
+            {", ".join(UPSTREAM_FIELDS)},
+            PRIMARY KEY (provider, day, key, dup)
+        );
+        CREATE INDEX IF NOT EXISTS txn_day ON txn (provider, day);
+        CREATE TABLE IF NOT EXISTS archive_day (
+            provider      TEXT NOT NULL,
+            day           TEXT NOT NULL,
+            count         INTEGER NOT NULL,
+            total_amount,
+            total_volume,
+            etag          TEXT,
+            last_modified TEXT,
+            synced_at     TEXT NOT NULL,
+            frozen        INTEGER NOT NULL DEFAULT 0,
+            revision      INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (provider, day)
+        );
+        """
+    )
+
+
+def _row_key(values, occurrences):
+    key = str(values[0]) if values[0] is not None else ""
+    dup = occurrences[key] = occurrences.get(key, -1) + 1
+    return key, dup
+
+
+def _known_rows(conn, provider, day, revision):
+    """(key, dup) → (rowid, hash) for a day, from memory when still current."""
+    live = _live.get((provider, day))
+    if live and live[0] == revision:
+        return live[1]
+    known, occurrences = {}, {}
+    for row in conn.execute(
+        f"SELECT rowid, {_columns} FROM txn WHERE provider = ? AND day = ? ORDER BY rowid",
+        (provider, day),
+    ):
+        # hash() is per process, which is all the in-memory map needs
+        known[_row_key(row[1:], occurrences)] = (row[0], hash(row[1:]))
+    return known
+
+
+def is_complete(day, now=None):
+    """True once `day` (ISO date) ended at least FREEZE_GRACE ago."""
+    end = datetime.combine(date.fromisoformat(day) + timedelta(days=1), datetime.min.time())
+    return (now or datetime.now()) >= end + FREEZE_GRACE
+
+
+def day_info(provider, day):
+    """Archive metadata for one provider/day, or None if never synced."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT count, total_amount, total_volume, etag, last_modified, synced_at, frozen "
+            "FROM archive_day WHERE provider = ? AND day = ?",
+            (provider, day),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    keys = ("count", "total_amount", "total_volume", "etag", "last_modified", "synced_at", "frozen")
+    return dict(zip(keys, row), provider=provider, day=day, frozen=bool(row[6]))
+
+
+def load_day(provider, day):
+    """The archived rows of one provider/day as dicts of UPSTREAM_FIELDS."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT {_columns} FROM txn WHERE provider = ? AND day = ? ORDER BY rowid",
+            (provider, day),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(UPSTREAM_FIELDS, r)) for r in rows]
+
+
+def sync_day(provider, day, rows, total_amount=None, total_volume=None,
+             etag=None, last_modified=None, now=None):
+    """
+    Bring the archive for one provider/day in line with upstream `rows`
+    (TxnRows or upstream dicts).
+
+    Rows are matched by order_id (repeated order_ids by occurrence) and
+    compared by their projected fields; only the difference is written.
+    The day is frozen when it is complete (see is_complete).
+    Returns {inserted, updated, deleted, unchanged, count, frozen}.
+    """
+    now = now or datetime.now()
+    frozen = is_complete(day, now)
+
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")   # no other worker syncs in between
+                row = conn.execute(
+                    "SELECT revision FROM archive_day WHERE provider = ? AND day = ?",
+                    (provider, day),
+                ).fetchone()
+                revision = row[0] if row else 0
+                existing = dict(_known_rows(conn, provider, day, revision))
+
+                known, occurrences = {}, {}
+                inserts, updates, unchanged = [], [], 0
+                for raw in rows:
+                    if isinstance(raw, TxnRow):
+                        values = _txn_values(raw)
+                    else:
+                        values = tuple(map(raw.get, UPSTREAM_FIELDS))
+                    key = _row_key(values, occurrences)
+                    h = hash(values)
+                    old = existing.pop(key, None)
+                    if old is None:
+                        inserts.append((key, h, (provider, day) + key + values))
+                    else:
+                        known[key] = (old[0], h)
+                        if old[1] != h:
+                            updates.append(values + (old[0],))
+                        else:
+                            unchanged += 1
+                deletes = [(rowid,) for rowid, _ in existing.values()]
+
+                if updates:
+                    conn.executemany(
+                        f"UPDATE txn SET {', '.join(f'{f} = ?' for f in UPSTREAM_FIELDS)} "
+                        "WHERE rowid = ?",
+                        updates,
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM txn WHERE rowid = ?", deletes)
+                insert_sql = (
+                    f"INSERT INTO txn (provider, day, key, dup, {_columns}) "
+                    f"VALUES ({', '.join('?' * (4 + len(UPSTREAM_FIELDS)))})"
+                )
+                if frozen:
+                    # no in-memory map is kept for frozen days, so no rowids needed
+                    conn.executemany(insert_sql, [params for _, _, params in inserts])
+                else:
+                    for key, h, params in inserts:
+                        known[key] = (conn.execute(insert_sql, params).lastrowid, h)
+                conn.execute(
+                    "INSERT OR REPLACE INTO archive_day (provider, day, count, total_amount, "
+                    "total_volume, etag, last_modified, synced_at, frozen, revision) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (provider, day, len(rows), total_amount, total_volume, etag,
+                     last_modified, now.isoformat(timespec="seconds"), int(frozen), revision + 1),
+                )
+                if frozen and KEEP_DAYS:
+                    _prune(conn, (now - timedelta(days=KEEP_DAYS)).isoformat(timespec="seconds"))
+        finally:
+            conn.close()
+
+        if frozen:
+            _live.pop((provider, day), None)
+        else:
+            _live[(provider, day)] = (revision + 1, known)
+
+    return {
+        "inserted": len(inserts), "updated": len(updates), "deleted": len(deletes),
+        "unchanged": unchanged, "count": len(rows), "frozen": frozen,
+    }
+
+
+def _prune(conn, synced_before):
+    # by archive age, not by date, so an old day someone looks at is kept
+    # for KEEP_DAYS too instead of being refetched on every view;
+    # day by day, so each delete is a primary-key range, not a table scan
+    old = conn.execute(
+        "SELECT provider, day FROM archive_day WHERE synced_at < ?", (synced_before,)
+    ).fetchall()
+    conn.executemany("DELETE FROM txn WHERE provider = ? AND day = ?", old)
+    conn.executemany("DELETE FROM archive_day WHERE provider = ? AND day = ?", old)
+
+
+def thaw(provider, day):
+    """Unfreeze a day so the next load re-syncs it from upstream."""
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE archive_day SET frozen = 0, etag = NULL, last_modified = NULL, "
+                    "revision = revision + 1 "
+                    "WHERE provider = ? AND day = ?",
+                    (provider, day),
+                )
+        finally:
+            conn.close()
@@ -0,0 +1,118 @@
+import sys
+from datetime import datetime
+
+# ---------------------------------------------------------
+# 🧾 Compact voucher transaction rows
+# ---------------------------------------------------------
+# Upstream sends one wide dict per transaction; cached days only need
+# the handful of fields the table, the CSV/XLSX export and the drawer
+# show. to_rows() projects each upstream dict onto a TxnRow:
+#
+#   UPSTREAM_FIELDS   copied as-is (display/export values unchanged)
+#   provider          tagged at conversion ("pinelabs" / "gyftr")
+#   INTERNED_FIELDS   as upstream, but sys.intern'd
+#   _ts               date + time as a sortable int (txn_sort_key)
+#   svc_balance_num   svc_balance parsed to float once (None if invalid)
+#   svc_deduction_num svc_deduction parsed once, missing → 0.0
+#   opening_balance, closing_balance, deposit   set by balance_engine
+#   _search           lowercase search key, set by index_transactions
+#
+# Every other upstream field is dropped. TxnRow keeps dict-style access
+# (row["x"], row.get("x"), row["x"] = v) so callers that take plain
+# dicts (write_excel, the CSV writer) work with either.
+
+UPSTREAM_FIELDS = (
+    "order_id", "user_id", "date", "time", "user_name", "brand",
+    "denomination", "qty", "requested_amount", "paid_by_user",
+    "svc_deduction", "svc_balance", "payment_method", "payment_status",
+    "voucher_status", "refund_status",
+)
+DERIVED_FIELDS = ("provider", "opening_balance", "closing_balance", "deposit")
+
+# low-cardinality strings repeated on every row; interned so a day holds
+# one copy of each value instead of one per row
+INTERNED_FIELDS = ("date", "time", "brand", "payment_method", "payment_status",
+                   "voucher_status", "refund_status")
+
+
+def txn_sort_key(date_str, time_str):
+    """
+    "2025-01-10", "09:05:03" → 20250110090503.
+
+    Fixed-format slicing instead of strptime; anything that is not the
+    exact zero-padded layout falls back to strptime.
+    """
+    if len(date_str) == 10 and len(time_str) == 8:
+        try:
+            return int(date_str[0:4] + date_str[5:7] + date_str[8:10]
+                       + time_str[0:2] + time_str[3:5] + time_str[6:8])
+        except ValueError:
+            pass
+    dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
+    return int(dt.strftime("%Y%m%d%H%M%S"))
+
+
+def parse_number(raw):
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+class TxnRow:
+    __slots__ = UPSTREAM_FIELDS + DERIVED_FIELDS + (
+        "_ts", "_search", "svc_balance_num", "svc_deduction_num",
+    )
+
+    def __init__(self, raw, provider=None):
+        get = raw.get
+        for field in UPSTREAM_FIELDS:
+            setattr(self, field, get(field))
+        for field in INTERNED_FIELDS:
+            value = getattr(self, field)
+            if type(value) is str:
+                setattr(self, field, sys.intern(value))
+        self.provider = provider or get("provider")
+        self.opening_balance = self.closing_balance = self.deposit = None
+        self._ts = txn_sort_key(self.date, self.time)
+        self._search = None
+        self.svc_balance_num = parse_number(self.svc_balance)
+        self.svc_deduction_num = parse_number(self.svc_deduction or 0)
+
+    # dict-style access, so existing row["x"] / row.get("x") callers keep working
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        try:
+            setattr(self, field, value)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __contains__(self, field):
+        return field in TxnRow.__slots__
+
+    def to_dict(self, fields=UPSTREAM_FIELDS + DERIVED_FIELDS):
+        return {f: getattr(self, f) for f in fields}
+
+    def __repr__(self):
+        return f"TxnRow({self.provider} {self.order_id} {self.date} {self.time})"
+
+
+def to_rows(raw_rows, provider=None):
+    """
+    Convert a list of upstream dicts to TxnRows.
+
+    `provider` tags every row; without it each row keeps its own
+    "provider" key, if any. Rows that are already TxnRows pass through.
+    """
+    return [
+        raw if isinstance(raw, TxnRow) else TxnRow(raw, provider)
+        for raw in raw_rows
+    ]
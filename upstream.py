@@ -0,0 +1,149 @@
+import os, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# ---------------------------------------------------------
+# 🌐 Shared upstream client for nexus.payppy.app
+# ---------------------------------------------------------
+# One pooled keep-alive session for every upstream call, so
+# page views reuse TCP+TLS connections instead of opening a
+# new one per request.
+
+NEXUS_BASE = os.environ.get("NEXUS_BASE_URL", "https://nexus.payppy.app")
+
+POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "20"))
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+GET_RETRIES = int(os.environ.get("UPSTREAM_GET_RETRIES", "2"))
+RETRY_BACKOFF = 0.3   # seconds, doubled on each attempt
+RETRY_STATUSES = (502, 503, 504)
+
+# read timeout (seconds) per logical endpoint
+READ_TIMEOUTS = {
+    "referral": 15,
+    "voucher-transactions": 60,
+    "voucher-detail": 30,
+    "customer-segregation": 30,
+    "user-cohorts": 60,
+    "cohort-refresh": 300,
+    "notifications": 30,
+    "elastic": 300,
+    "brands-refresh": 300,
+    "brand-details": 120,
+}
+DEFAULT_READ_TIMEOUT = 30
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _record(endpoint, elapsed_ms, ok):
+    metrics.UPSTREAM_SECONDS.observe(elapsed_ms / 1000, endpoint=endpoint,
+                                     outcome="ok" if ok else "error")
+    with _stats_lock:
+        s = _stats.setdefault(endpoint, {
+            "calls": 0, "errors": 0, "retries": 0,
+            "total_ms": 0.0, "max_ms": 0.0,
+        })
+        s["calls"] += 1
+        if not ok:
+            s["errors"] += 1
+        s["total_ms"] += elapsed_ms
+        if elapsed_ms > s["max_ms"]:
+            s["max_ms"] = elapsed_ms
+
+
+def _count_retry(endpoint):
+    metrics.UPSTREAM_RETRIES.inc(endpoint=endpoint)
+    with _stats_lock:
+        _stats.setdefault(endpoint, {
+            "calls": 0, "errors": 0, "retries": 0,
+            "total_ms": 0.0, "max_ms": 0.0,
+        })["retries"] += 1
+
+
+def timeout_for(endpoint):
+    return (CONNECT_TIMEOUT, READ_TIMEOUTS.get(endpoint, DEFAULT_READ_TIMEOUT))
+
+
+def request(method, endpoint, url, retries=None, deadline=None, **kwargs):
+    """
+    Send one upstream request through the shared session.
+
+    `endpoint` is a short label used for the timeout table and the
+    latency counters. GETs are retried with backoff on connection
+    errors and 502/503/504; other methods are sent exactly once.
+    `deadline` (a time.monotonic() value) bounds the whole call,
+    retries included: each attempt's timeouts are cut to the time left
+    and no retry starts that could not finish before it.
+    """
+    timeout = kwargs.pop("timeout", None) or timeout_for(endpoint)
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    if retries is None:
+        retries = GET_RETRIES if method == "GET" else 0
+
+    def out_of_retries(attempt):
+        if attempt >= retries:
+            return True
+        return deadline is not None and \
+            time.monotonic() + RETRY_BACKOFF * (2 ** attempt) >= deadline
+
+    attempt = 0
+    while True:
+        if deadline is None:
+            kwargs["timeout"] = timeout
+        else:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise requests.Timeout(f"{endpoint}: deadline passed before the request was sent")
+            kwargs["timeout"] = (min(timeout[0], left), min(timeout[1], left))
+
+        start = time.perf_counter()
+        try:
+            resp = _session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _record(endpoint, (time.perf_counter() - start) * 1000, False)
+            if out_of_retries(attempt):
+                raise
+        else:
+            ok = resp.status_code < 500
+            _record(endpoint, (time.perf_counter() - start) * 1000, ok)
+            if resp.status_code not in RETRY_STATUSES or out_of_retries(attempt):
+                return resp
+            resp.close()
+
+        _count_retry(endpoint)
+        time.sleep(RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
+
+def get(endpoint, url, **kwargs):
+    return request("GET", endpoint, url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    return request("POST", endpoint, url, **kwargs)
+
+
+def delete(endpoint, url, **kwargs):
+    return request("DELETE", endpoint, url, **kwargs)
+
+
+def stats():
+    """Snapshot of per-endpoint call counts and latencies (ms)."""
+    with _stats_lock:
+        out = {}
+        for name, s in _stats.items():
+            out[name] = {
+                **s,
+                "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0,
+                "total_ms": round(s["total_ms"], 2),
+                "max_ms": round(s["max_ms"], 2),
+            }
+        return out
@@ -0,0 +1,443 @@
+import logging, math, tempfile, time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+import upstream, closing_ledger, metrics, txn_archive
+from balance_engine import apply_balances
+from mailer import MailDispatcher, build_attachment
+from txn_rows import to_rows
+
+# ---------------------------------------------------------
+# 🧾 Voucher day pipeline: fetch → balances → Excel → email
+# ---------------------------------------------------------
+# Everything the daily report needs, shared with the dashboard:
+# provider fetches (through the archive), the previous-day closing,
+# the balance pass, the Excel writer and the report email. The report
+# scheduler imports this module rather than the Flask app.
+
+log = logging.getLogger("dashboard")
+
+API_URL = f"{upstream.NEXUS_BASE}/api/dashboard/v2/voucher-transactions"
+
+NOT_FETCHED = object()   # "caller did not supply prev closing"
+LOOKUP_FAILED = object()  # prev closing lookup failed (None means there is none)
+
+# ---------------------------------------------------------
+# 🧠 Day closing balance (latest SUCCESS txn with svc_balance)
+# ---------------------------------------------------------
+def parse_query_date(date_str):
+    # accept either format used by the dashboard / reports
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return datetime.strptime(date_str, "%d/%m/%Y").date()
+
+
+def day_closing_balance(txns):
+    """Return (closing, order_id) for a day's normalised pinelabs rows, or (None, None)."""
+    # latest SUCCESS txn with a valid svc_balance, in one pass
+    best_ts, best = None, (None, None)
+    for txn in txns:
+        if txn.voucher_status != "SUCCESS":
+            # skip failed / pending vouchers
+            continue
+        if best_ts is not None and txn._ts <= best_ts:
+            continue
+        if txn.svc_balance_num is None:
+            # svc_balance missing / invalid → ignore this txn
+            continue
+        best, best_ts = (txn.svc_balance_num, txn.order_id), txn._ts
+
+    return best
+
+
+def remember_day_closing(date_str, pinelabs_txns):
+    """Record a finished day's closing in the ledger once its rows are loaded."""
+    day = parse_query_date(date_str)
+    if day >= date.today() or not pinelabs_txns:
+        return  # today is still moving
+    if closing_ledger.get_closing("pinelabs", day.isoformat()) is not None:
+        return
+
+    closing, order_id = day_closing_balance(pinelabs_txns)
+    if closing is not None:
+        closing_ledger.record_closing("pinelabs", day.isoformat(), closing, order_id)
+
+# ---------------------------------------------------------
+# 🧠 Get Previous Day Closing Balance
+# ---------------------------------------------------------
+def get_previous_day_closing_balance(current_date_str, deadline=None):
+    """
+    Pinelabs closing of the day before `current_date_str`, or None when
+    that day has no usable closing. Raises RuntimeError when the lookup
+    itself failed, so callers do not cache numbers built on a guess.
+    `deadline` is passed on to the upstream fetch (see upstream.request).
+    """
+    prev_date_str = (parse_query_date(current_date_str) - timedelta(days=1)).isoformat()
+
+    # 1️⃣ Ledger hit → no upstream round trip
+    with metrics.stage("ledger"):
+        cached = closing_ledger.get_closing("pinelabs", prev_date_str)
+    if cached is not None:
+        return cached
+
+    # 2️⃣ Backfill from the previous day's transactions (archive first)
+    log.info("[prev-day] Ledger miss, loading previous-day data for %s", prev_date_str)
+
+    payload = fetch_provider_data(prev_date_str, "pinelabs", deadline=deadline)
+    if payload.get("error"):
+        log.warning("[prev-day] %s", payload["error"])
+        raise RuntimeError(f"Previous-day closing for {prev_date_str}: {payload['error']}")
+
+    data = payload["data"]
+    if not data:
+        log.info("[prev-day] No data for prev day")
+        return None
+
+    bal, order_id = day_closing_balance(data)
+    if bal is None:
+        log.info("[prev-day] No SUCCESS txn had a valid svc_balance")
+        return None
+
+    log.debug("[prev-day] Using closing from SUCCESS order %s: %s", order_id, bal)
+    remember_day_closing(prev_date_str, data)
+    return bal
+
+def prev_closing_or_failed(current_date_str):
+    """get_previous_day_closing_balance, with a failed lookup as LOOKUP_FAILED."""
+    try:
+        return get_previous_day_closing_balance(current_date_str)
+    except Exception as e:
+        log.warning("[prev-day] Error: %s", e)
+        return LOOKUP_FAILED
+
+# ---------------------------------------------------------
+# ⏱️ Normalise rows once: upstream dicts → compact TxnRows
+# ---------------------------------------------------------
+def normalise_rows(rows, provider=None):
+    """Project upstream rows onto TxnRows tagged with `provider` (see txn_rows)."""
+    return to_rows(rows, provider)
+
+# ---------------------------------------------------------
+# 🔎 Fetch provider data (Pinelabs or Gyftr)
+# ---------------------------------------------------------
+# Goes through the local archive (see txn_archive): frozen past days
+# never reach upstream, and every upstream download is diffed into it.
+def archived_payload(provider, info):
+    """A provider/day payload rebuilt from the archive."""
+    with metrics.stage("archive"):
+        rows = txn_archive.load_day(provider, info["day"])
+    payload = {"data": normalise_rows(rows, provider), "archived_at": info["synced_at"]}
+    for total in ("total_amount", "total_volume"):
+        if info[total] is not None:
+            payload[total] = info[total]
+    return payload
+
+
+# archive writes are off the request path, one at a time, in arrival order;
+# the day's validators are stored with its rows, so a 304 is only ever
+# answered from a completed write
+ARCHIVE_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+
+def archive_day(provider, day, rows, *meta):
+    try:
+        with metrics.stage("archive"):
+            synced = txn_archive.sync_day(provider, day, rows, *meta)
+    except Exception as e:
+        log.warning("[archive] %s %s not archived: %s", provider, day, e)
+        return
+    log.info("[archive] %s %s: %s new, %s changed, %s removed, %s unchanged%s",
+             provider, day, synced["inserted"], synced["updated"], synced["deleted"],
+             synced["unchanged"], " (frozen)" if synced["frozen"] else "")
+
+
+def fetch_provider_data(query_date, provider_param=None, deadline=None):
+    provider = "gyftr" if provider_param == "gyftr" else "pinelabs"
+    if provider_param == "gyftr":
+        url = f"{API_URL}?date={query_date}&provider=gyftr"
+    else:
+        url = f"{API_URL}?date={query_date}"
+
+    try:
+        day = parse_query_date(query_date).isoformat()
+        info = txn_archive.day_info(provider, day) if txn_archive.ENABLED else None
+        if info and info["frozen"]:
+            return archived_payload(provider, info)
+
+        headers = {}
+        if info and info["etag"]:
+            headers["If-None-Match"] = info["etag"]
+        if info and info["last_modified"]:
+            headers["If-Modified-Since"] = info["last_modified"]
+
+        r = upstream.get("voucher-transactions", url, headers=headers, deadline=deadline)
+        if r.status_code == 304 and info:
+            return archived_payload(provider, info)
+        if r.status_code == 200:
+            with metrics.stage("parse"):
+                payload = r.json()
+                payload["data"] = normalise_rows(payload.get("data", []), provider)
+            if txn_archive.ENABLED:
+                # a snapshot: the list itself is sorted in place by
+                # build_voucher_day, and a list reads as empty mid-sort
+                ARCHIVE_WRITER.submit(
+                    archive_day, provider, day, tuple(payload["data"]),
+                    payload.get("total_amount"), payload.get("total_volume"),
+                    r.headers.get("ETag"), r.headers.get("Last-Modified"),
+                )
+            return payload
+        return {"data": [], "total_amount": 0, "total_volume": 0,
+                "error": f"Upstream error {r.status_code}"}
+    except Exception as e:
+        return {"data": [], "total_amount": 0, "total_volume": 0, "error": str(e)}
+
+# ---------------------------------------------------------
+# ⚡ Concurrent provider fan-out
+# ---------------------------------------------------------
+FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fetch")
+# seconds, shared by every fetch of one fan-out; the fetches themselves
+# (retries included) stop at it too, so a hanging upstream cannot keep
+# FETCH_POOL's workers busy after the page has given up on them
+FANOUT_DEADLINE = 90
+
+def fetch_providers_concurrently(query_date, providers, with_prev_closing=False):
+    """
+    Fetch each provider's day (and optionally the previous-day pinelabs
+    closing balance) in parallel under one shared deadline.
+
+    Returns (results, prev_closing, failed). `results` maps provider to
+    its payload (rows come back tagged with `provider` by
+    normalise_rows); a provider that errors or misses the deadline
+    gets an empty payload and is listed in `failed`, so callers can
+    still render the others. `prev_closing` is LOOKUP_FAILED when that
+    lookup errored or missed the deadline.
+    """
+    deadline = time.monotonic() + FANOUT_DEADLINE
+    futures = {
+        p: FETCH_POOL.submit(fetch_provider_data, query_date, p, deadline=deadline)
+        for p in providers
+    }
+    prev_future = (
+        FETCH_POOL.submit(get_previous_day_closing_balance, query_date, deadline=deadline)
+        if with_prev_closing else None
+    )
+
+    pending = list(futures.values()) + ([prev_future] if prev_future else [])
+    wait(pending, timeout=FANOUT_DEADLINE)
+
+    results, failed = {}, []
+    for p, fut in futures.items():
+        if fut.done() and not fut.exception():
+            payload = fut.result()
+        else:
+            payload = {"data": [], "total_amount": 0, "total_volume": 0,
+                       "error": "Timed out"}
+        if payload.get("error"):
+            log.warning("[fan-out] %s failed for %s: %s", p, query_date, payload["error"])
+            failed.append(p)
+        results[p] = payload
+
+    prev_closing = None
+    if prev_future:
+        if prev_future.done() and not prev_future.exception():
+            prev_closing = prev_future.result()
+        else:
+            log.warning("[fan-out] previous-day closing failed for %s: %s", query_date,
+                        prev_future.exception() if prev_future.done() else "Timed out")
+            prev_closing = LOOKUP_FAILED
+
+    return results, prev_closing, failed
+
+
+# columns shared by the table, CSV export and Excel report
+EXPORT_FIELDS = [
+    "date",
+    "time",
+    "order_id",
+    "provider",
+    "user_name",
+    "brand",
+    "denomination",
+    "qty",
+    "requested_amount",
+    "paid_by_user",
+    "svc_deduction",
+    "opening_balance",
+    "closing_balance",
+    "deposit",
+    "payment_method",
+    "payment_status",
+    "voucher_status",
+    "refund_status",
+    "svc_balance",
+]
+
+# ---------------------------------------------------------
+# 🧠 Export Voucher Transactions to EXCEL For Email
+# ---------------------------------------------------------
+EXCEL_NUMERIC_FIELDS = {
+    "denomination", "qty", "requested_amount", "paid_by_user",
+    "svc_deduction", "opening_balance", "closing_balance", "deposit",
+    "svc_balance",
+}
+EXCEL_COLUMN_WIDTHS = {
+    "date": 12, "time": 10, "order_id": 28, "provider": 10,
+    "user_name": 22, "brand": 22, "payment_method": 10,
+    "payment_status": 14, "voucher_status": 14, "refund_status": 14,
+}
+EXCEL_SPOOL_BYTES = 8 * 1024 * 1024   # spill to disk above this
+
+
+def _excel_number(v):
+    # upstream sends some amounts as strings; write them as numbers
+    if isinstance(v, str):
+        try:
+            n = float(v)
+        except ValueError:
+            return v
+        if not math.isfinite(n):
+            return v
+        return int(n) if n.is_integer() and "." not in v else n
+    return v
+
+
+def write_excel(transactions):
+    """
+    Stream transactions into an XLSX using openpyxl's write-only mode.
+
+    Rows go straight to the output instead of an in-memory cell model.
+    Returns a spooled temp file positioned at 0 (kept in RAM when small,
+    on disk when large) that can be streamed or read once.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Transactions")
+
+    for i, field in enumerate(EXPORT_FIELDS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = EXCEL_COLUMN_WIDTHS.get(field, 14)
+    ws.freeze_panes = "A2"
+
+    header_font = Font(bold=True)
+    header = []
+    for field in EXPORT_FIELDS:
+        cell = WriteOnlyCell(ws, value=field)
+        cell.font = header_font
+        header.append(cell)
+    ws.append(header)
+
+    numeric = [f in EXCEL_NUMERIC_FIELDS for f in EXPORT_FIELDS]
+    with metrics.stage("excel"):
+        for txn in transactions:
+            ws.append([
+                _excel_number(txn.get(f)) if is_num else txn.get(f)
+                for f, is_num in zip(EXPORT_FIELDS, numeric)
+            ])
+
+        output = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES)
+        wb.save(output)
+    output.seek(0)
+    return output
+
+
+def generate_excel(transactions):
+    """XLSX bytes for callers that need the whole file (e.g. email attachments)."""
+    with write_excel(transactions) as f:
+        return f.read()
+
+
+# ---------------------------------------------------------
+# 🧠 Fetch one day's Transactions for the report
+# ---------------------------------------------------------
+def fetch_report_transactions(date_str, with_prev_closing=True):
+    """
+    Both providers' rows for `date_str` → (txns, prev_closing).
+
+    Raises if a provider or the previous-day closing could not be
+    fetched, so the scheduler retries the day instead of mailing a
+    partial report.
+    """
+    results, prev_closing, failed = fetch_providers_concurrently(
+        date_str, ["pinelabs", "gyftr"], with_prev_closing=with_prev_closing
+    )
+    if failed:
+        raise RuntimeError(f"Could not fetch {', '.join(failed)} for {date_str}")
+    if prev_closing is LOOKUP_FAILED:
+        raise RuntimeError(f"Could not fetch the previous-day closing for {date_str}")
+
+    remember_day_closing(date_str, results["pinelabs"]["data"])
+
+    all_txns = results["pinelabs"]["data"] + results["gyftr"]["data"]
+    return all_txns, prev_closing
+
+
+def report_date_for_today():
+    # Server is in UTC, job runs at 02:00 UTC (7:30 AM IST).
+    # At that time date.today() is the *current* IST date,
+    # so yesterday = immediate previous IST calendar date.
+    return (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+
+# ---------------------------------------------------------
+# 🧠 Fetch Yesterday's Transactions (for 7:30 AM IST schedule)
+# ---------------------------------------------------------
+def fetch_yesterday_transactions():
+    yesterday = report_date_for_today()
+    all_txns, prev_closing = fetch_report_transactions(yesterday)
+    return all_txns, yesterday, prev_closing
+
+# ---------------------------------------------------------
+# 🧠 Enrich Transactions with Balance and Deposit Logic
+# ---------------------------------------------------------
+def enrich_with_balance_and_deposit(transactions, query_date, prev_closing=NOT_FETCHED):
+    """Sort newest → oldest and apply the same balance engine as the dashboard."""
+    with metrics.stage("sort"):
+        transactions.sort(key=lambda x: x._ts, reverse=True)
+
+    if prev_closing is NOT_FETCHED:
+        prev_closing = get_previous_day_closing_balance(query_date)
+
+    with metrics.stage("balances"):
+        apply_balances(transactions, prev_closing)
+    return transactions
+
+# ---------------------------------------------------------
+# 🧠 Report email
+# ---------------------------------------------------------
+def report_message(date_str):
+    """(subject, html body, attachment filename) for one day's report."""
+    subject = f"Pepmo Daily Transactions Report — {date_str}"
+    body = f"""
+        <h3>Pepmo Daily Report</h3>
+        <p>Attached is the Excel report for <b>{date_str}</b>.</p>
+    """
+    return subject, body, f"Pepmo_Report_{date_str}.xlsx"
+
+
+def send_report_file(mail, recipients, date_str, excel_file):
+    """Send one rendered report over an open MailDispatcher → result dict."""
+    subject, body, filename = report_message(date_str)
+
+    # encode once, one SMTP session for every recipient
+    attachment = build_attachment(excel_file, filename)
+    results = mail.send_each(recipients, subject, body, [attachment])
+
+    sent = sum(1 for r in results.values() if r == "sent")
+    status = "sent" if sent == len(results) else ("partial" if sent else "failed")
+    return {"status": status, "recipients": results}
+
+# ---------------------------------------------------------
+# 🧠 Fetch Yesterday's Transactions and Generate Report
+# ---------------------------------------------------------
+def send_daily_excel_report(recipients, date_str=None):
+    date_str = date_str or report_date_for_today()
+    txns, prev_closing = fetch_report_transactions(date_str)
+    if not txns:
+        return {"status": "No data"}
+
+    sorted_txns = enrich_with_balance_and_deposit(txns, date_str, prev_closing)
+    excel_file = generate_excel(sorted_txns)
+
+    with MailDispatcher() as mail:
+        return send_report_file(mail, recipients, date_str, excel_file)